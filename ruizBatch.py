@@ -0,0 +1,176 @@
+#######################################################################
+#Batch Runs
+
+#Runs the column-and-constraint method of ruizMain on many datasets at
+#once, with no one at the keyboard. Each dataset is a job with its
+#own lines at start and settings of RC, and runs in a process of its
+#own, at most RC.WORKERS of them at a time.
+
+#Input–	(From user) A JSON file of jobs, optional file for the results
+#		and optional number of workers.
+#		python ruizBatch.py jobs.json [results.jsonl] [workers]
+#		Each job is
+#			{"data": "Tests/TEP/data.dat",
+#			 "x_star": [[1, 2, 1], [1, 3, 1], ...],
+#			 "settings": {"TOPK": 2, ...}}
+#		"data" is relative to the jobs file. "x_star" must be given,
+#		[] for no lines at start, and every line in it must be in
+#		L of the data. "settings" may be left out, for the defaults
+#		of RC.
+
+#Output- (To user) One JSON line per job, as each one finishes, with
+#		 the bounds, gap, iterations, design, times and peak memory of
+#		 the run (see RESULT in ruizMain), or the error it stopped on.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+import ruizC as RC
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import builtins
+import contextlib
+import json
+import os
+import runpy
+import sys
+import time
+try:
+	import resource
+except ImportError:			#Not on Windows
+	resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+###############################################################
+#Batch Job
+
+# batch_job(job)
+
+#Input-	Job. Dictionary of one job, as in the jobs file, with "data"
+#			as an absolute path.
+
+#Output- RESULT of ruizMain for the job, with "job" the job itself,
+#		 "rss" the peak memory of the worker in MB, or None where it
+#		 cannot be read, and "error" if the run failed or the job
+#		 has no "x_star" for its data.
+#
+# Runs in a worker process that runs no other job, so the settings
+# and the modules ruizMain imports start fresh, and the peak memory
+# is that of this job. The pauses and the dump of the subproblem are
+# off, and what ruizMain still prints is thrown away.
+###############################################################
+
+def batch_job(job):
+
+	start = time.time()
+	res = {'job': job, 'rss': None, 'error': None}
+	try:
+		for name, val in job.get('settings', {}).items():
+			setattr(RC, name, val)
+		RC.DATA = job['data']
+		RC.PAUSE = False
+		RC.VERBOSE = False
+		#A new worker imports the caller's script again as __mp_main__,
+		#and with it any ruiz modules that script imports (ruizBench
+		#brings in ruizSub, ruizDual and ruizData). Those were made
+		#under the default settings, so ruizMain imports them again.
+		for name in list(sys.modules):
+			if name.startswith('ruiz') and name not in ('ruizC', 'ruizBatch'):
+				del sys.modules[name]
+
+		#Lines at start must be given, and be lines of this data, or
+		#ruizMain would start from its own 6-bus lines
+		if 'x_star' not in job:
+			raise ValueError("job has no x_star, give [] for no lines")
+		import ruizData as RD
+		L = set(tuple(l) for l in RD.data_load(job['data'])['L'])
+		bad = [l for l in job['x_star'] if tuple(l[:2]) not in L]
+		if bad:
+			raise ValueError("x_star lines not in L of %s: %s"
+							 % (job['data'], bad))
+		RC.XSTAR = job['x_star']
+		builtins.input = lambda *args: ''
+		with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+			run = runpy.run_path(os.path.join(HERE, 'ruizMain.py'),
+								 run_name='__main__')
+		res.update(run['RESULT'])
+	except Exception as e:
+		res['error'] = repr(e)
+		res['times'] = {'total': time.time() - start}
+	res['rss'] = batch_rss()
+	return res
+
+
+###############################################################
+#Batch Peak Memory
+
+# batch_rss()
+
+#Output- Peak resident memory of this process so far, in MB, or None
+#		 where the resource module is missing.
+###############################################################
+
+def batch_rss():
+
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	#Bytes on macOS, kilobytes elsewhere
+	return peak / (2.0**20 if sys.platform == 'darwin' else 2.0**10)
+
+
+###############################################################
+#Batch Run
+
+# batch_run(jobs, workers)
+
+#Input-	Jobs. List of jobs, each as in batch_job.
+#		Workers. Most jobs to run at once.
+
+#Output- Iterator over the results of batch_job, in the order they
+#		 finish. Each also has "index", the place of its job in
+#		 "jobs".
+###############################################################
+
+def batch_run(jobs, workers=RC.WORKERS):
+
+	with ProcessPoolExecutor(max_workers=workers,
+							 max_tasks_per_child=1) as pool:
+		futures = dict((pool.submit(batch_job, job), n)
+					   for n, job in enumerate(jobs))
+		for f in as_completed(futures):
+			yield dict(f.result(), index=futures[f])
+
+
+###############################################################
+#Batch Read
+
+# batch_read(fname)
+
+#Input-	Fname. JSON file of jobs.
+
+#Output- The list of jobs, with each "data" made absolute.
+###############################################################
+
+def batch_read(fname):
+
+	with open(fname) as f:
+		jobs = json.load(f)
+	base = os.path.dirname(os.path.abspath(fname))
+	for job in jobs:
+		job['data'] = os.path.join(base, job['data'])
+	return jobs
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		sys.exit("usage: python ruizBatch.py jobs.json [results.jsonl]"
+				 " [workers]")
+	jobs = batch_read(sys.argv[1])
+	out = open(sys.argv[2], 'w') if len(sys.argv) > 2 else sys.stdout
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else RC.WORKERS
+	for res in batch_run(jobs, workers):
+		out.write(json.dumps(res) + "\n")
+		out.flush()
+	if out is not sys.stdout:
+		out.close()
@@ -0,0 +1,387 @@
+#######################################################################
+#Benchmarks
+
+#Times the subproblem on the datasets bundled in Tests/ under each
+#complementarity formulation (RC.COMP), under the strong duality
+#engine (ruizDual) and as sparse matrices (ruizMat), for the same
+#random designs.
+#The objectives of every formulation should agree.
+
+#Also times the whole column-and-constraint run of ruizMain on the
+#same datasets under different settings, such as pure C&CG against
+#C&CG with Benders cuts (RC.BENDERS) or with loose MIP gaps
+#(RC.ADAPTGAP).
+
+#The suite runs the whole C&CG on the datasets of SUITESETS with the
+#fixed settings of SUITE, several times each, one fresh process per run,
+#and keeps the build and solver times, iterations, gap and peak
+#memory of each. Its JSON file is the baseline to hold changes for
+#speed against.
+
+#Input–	(From user) What to time, and optional name of a JSON file for
+#		the results.
+#		python ruizBench.py [comp|ccg|suite] [results.json]
+
+#Output- (To user) A table of times per dataset and formulation or
+#				   setting, and the JSON file if one is given.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+import ruizC as RC
+import ruizSub as s
+import ruizDual
+import ruizData as RD
+import ruizBatch as RB
+import builtins
+import contextlib
+import io
+import json
+import os
+import random
+import runpy
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#Bundled datasets
+DATASETS = ['Tests/TEP/data.dat', 'Tests/MINGUEZ/data.dat',
+			'Tests/GAMS/data.dat', 'Tests/24Bus/data.dat',
+			'Tests/BASIC/firstmast/data.dat', 'Tests/BASIC/master2/data.dat']
+
+#Formulations to compare, "dual" is the strong duality engine and
+#"mat" the matrix builder
+COMPS = ['bigm', 'sos1', 'indicator', 'dual', 'mat']
+
+DESIGNS = 3			#Random designs per dataset
+SEED = 0			#Seed of the random designs
+
+#Settings of RC for each run of ruizMain to compare
+MODES = [('ccg', {'BENDERS': False}), ('hybrid', {'BENDERS': True}),
+		 ('ccg-age', {'BENDERS': False, 'AGE': 1}),
+		 ('hybrid-age', {'BENDERS': True, 'AGE': 1}),
+		 ('inexact', {'ADAPTGAP': True})]
+
+#Settings of RC for every run of the suite, fixed so that a change of
+#a default does not move the baseline. A run that is out of time
+#stops with the best design so far and its gap
+SUITE = {'ENGINE': 'kkt', 'COMP': 'bigm', 'MIPGAP': 1e-12, 'EPSILON': 1e-7,
+		 'REUSESUB': True, 'DROPLINES': True, 'TIGHTM': True, 'OBBT': False,
+		 'PERSISTENT': True, 'SUBSTART': True, 'MASTSTART': True, 'AGE': 0,
+		 'TOPK': 1, 'POOLK': 1, 'BENDERS': False, 'ADAPTGAP': False,
+		 'TIMELIMIT': 600, 'CHECKPOINT': ''}
+REPEATS = 3			#Runs of each dataset in the suite
+SUITEVERSION = 2	#Format of the suite's JSON file
+
+#Datasets of the suite and their lines at start, as START_X_STAR,
+#[] for none, as in the ruizMain of their folders
+#Tests/BASIC is data of the early one step program (a ref angle per
+#node, conLen, gen_mu) that the models of today do not read, and
+#Tests/24Bus is past the size limits of CPLEX Community Edition.
+#Their runs stay in the suite, with the error they stop on.
+SUITESETS = [('Tests/TEP/data.dat', []), ('Tests/MINGUEZ/data.dat', []),
+			 ('Tests/GAMS/data.dat', []), ('Tests/24Bus/data.dat', []),
+			 ('Tests/BASIC/firstmast/data.dat', []),
+			 ('Tests/BASIC/master2/data.dat', [])]
+
+
+###############################################################
+#Benchmark Formulations
+
+# bench_comp(datasets, comps, designs, seed)
+
+#Input-	Datasets. Data files, relative to this folder.
+#		Comps. Values of RC.COMP to compare, or "dual" or "mat".
+#		Designs. Number of random designs per dataset.
+#		Seed. Seed of the random designs.
+
+#Output- List of one record per dataset and formulation, with
+#			data, comp 	- Dataset and formulation
+#			build 		- Time to build the instance
+#			solve 		- Time of each solve
+#			obj 		- Objective of each solve
+#			error 		- Error message if the dataset failed
+#
+# ruizMat builds its problem for each design, so for "mat" build is
+# the sum of those builds.
+###############################################################
+
+def bench_comp(datasets=DATASETS, comps=COMPS, designs=DESIGNS, seed=SEED):
+
+	records = []
+	old = RC.COMP
+	for path in datasets:
+		for comp in comps:
+			RC.COMP = comp
+			sub = ruizDual if comp == 'dual' else s
+			rec = {'data': path, 'comp': comp, 'build': None,
+				'solve': [], 'obj': [], 'error': None}
+			records.append(rec)
+			try:
+				data = RD.data_load(os.path.join(HERE, path))
+				if comp == 'mat':
+					bench_mat(rec, data, designs, seed)
+					continue
+				start = time.time()
+				isub = sub.mod.create_instance(data)
+				rec['build'] = time.time() - start
+
+				#Same designs for every formulation
+				rand = random.Random(seed)
+				for n in range(designs):
+					x = dict((l, rand.randint(0, 1)) for l in isub.L)
+					sub.sub_func(isub, x)
+					start = time.time()
+					sub.sub_solve(isub)
+					rec['solve'].append(time.time() - start)
+					rec['obj'].append(value(isub.Obj))
+			except Exception as e:
+				rec['error'] = repr(e)
+	RC.COMP = old
+	return records
+
+
+###############################################################
+#Benchmark Matrix Builder
+
+# bench_mat(rec, data, designs, seed)
+
+#Input-	Rec. Record of bench_comp to fill.
+#		Data. Loaded data of the dataset.
+#		Designs, Seed. As bench_comp.
+
+#Output- Fills build, solve and obj of "rec", for the same random
+#		 designs as the other formulations.
+###############################################################
+
+def bench_mat(rec, data, designs, seed):
+
+	import ruizMat as RM		#Needs numpy and scipy
+	rec['build'] = 0
+	rand = random.Random(seed)
+	for n in range(designs):
+		x = dict((tuple(l), rand.randint(0, 1)) for l in data['L'])
+		start = time.time()
+		mat = RM.mat_build(data, x)
+		rec['build'] += time.time() - start
+		start = time.time()
+		res = RM.mat_solve(mat)
+		rec['solve'].append(time.time() - start)
+		rec['obj'].append(res['Obj'])
+
+
+###############################################################
+#Benchmark Column-and-Constraint
+
+# bench_ccg(datasets, modes)
+
+#Input-	Datasets. Data files, relative to this folder.
+#		Modes. List of (name, {RC setting: value}) to compare.
+
+#Output- List of one record per dataset and mode, with
+#			data, mode 	- Dataset and name of the mode
+#			time 		- Time of the whole run
+#			iters 		- Iterations of the main loop
+#			lb, ub 		- Bounds at the end of the run
+#			error 		- Error message if the run failed
+#
+# Runs ruizMain in the folder of each dataset, as a user would, with
+# its pauses and dump of the subproblem skipped and its printing
+# thrown away.
+###############################################################
+
+def bench_ccg(datasets=DATASETS, modes=MODES):
+
+	records = []
+	cwd = os.getcwd()
+	pause, verbose = builtins.input, RC.VERBOSE
+	builtins.input = lambda *args: ''
+	RC.VERBOSE = False
+	try:
+		for path in datasets:
+			for name, settings in modes:
+				rec = {'data': path, 'mode': name, 'time': None,
+					'iters': None, 'lb': None, 'ub': None, 'error': None}
+				records.append(rec)
+				old = dict((key, getattr(RC, key)) for key in settings)
+				try:
+					for key, val in settings.items():
+						setattr(RC, key, val)
+					os.chdir(os.path.dirname(os.path.join(HERE, path)))
+					start = time.time()
+					with contextlib.redirect_stdout(io.StringIO()):
+						run = runpy.run_path(os.path.join(HERE, 'ruizMain.py'),
+											 run_name='__main__')
+					rec['time'] = time.time() - start
+					res = run['RESULT']
+					rec['iters'], rec['lb'], rec['ub'] = (res['iters'],
+														 res['lb'], res['ub'])
+				except Exception as e:
+					rec['error'] = repr(e)
+				finally:
+					os.chdir(cwd)
+					for key, val in old.items():
+						setattr(RC, key, val)
+	finally:
+		builtins.input, RC.VERBOSE = pause, verbose
+	return records
+
+
+###############################################################
+#Benchmark Suite
+
+# bench_suite(datasets, settings, repeats)
+
+#Input-	Datasets. List of (data file, lines at start), with the data
+#			file relative to this folder, as SUITESETS.
+#		Settings. {RC setting: value} of every run.
+#		Repeats. Runs of each dataset.
+
+#Output- Dictionary of
+#			version 	- SUITEVERSION
+#			solver 		- RC.SOLVER and RC.PSOLVER
+#			datasets 	- {data file: lines at start}
+#			settings, repeats - As given
+#			runs 		- One record per run, by dataset then repeat,
+#						  with
+#				data, repeat 	- Dataset and number of the run
+#				build 			- Time to build the models
+#				solve 			- Time in the master and subproblem
+#								  solves
+#				total 			- Time of the whole run
+#				iters 			- Iterations of the main loop
+#				lb, ub, gap 	- Bounds and gap at the end
+#				rss 			- Peak memory of the run in MB
+#				error 			- Error message if the run failed
+#
+# Each run is a job of ruizBatch in a process of its own, one at a
+# time, so runs do not share memory or fight for the cores.
+###############################################################
+
+def bench_suite(datasets=SUITESETS, settings=SUITE, repeats=REPEATS):
+
+	jobs = [{'data': os.path.join(HERE, path), 'x_star': x_star,
+			 'settings': settings}
+			for path, x_star in datasets for n in range(repeats)]
+	runs = [None] * len(jobs)
+	for res in RB.batch_run(jobs, workers=1):
+		n = res['index']
+		times = res.get('times', {})
+		rec = {'data': datasets[n // repeats][0], 'repeat': n % repeats,
+			'build': times.get('build'), 'solve': None,
+			'total': times.get('total'), 'iters': res.get('iters'),
+			'lb': res.get('lb'), 'ub': res.get('ub'), 'gap': res.get('gap'),
+			'rss': res['rss'], 'error': res['error']}
+		if res['error'] is None:
+			rec['solve'] = times['master'] + times['sub']
+		runs[n] = rec
+	return {'version': SUITEVERSION,
+			'solver': {'SOLVER': settings.get('SOLVER', RC.SOLVER),
+					   'PSOLVER': settings.get('PSOLVER', RC.PSOLVER)},
+			'datasets': dict((path, x_star) for path, x_star in datasets),
+			'settings': dict(settings), 'repeats': repeats, 'runs': runs}
+
+
+###############################################################
+#Benchmark Table
+
+# bench_table(records)
+
+#Input-	Records. Output of bench_comp.
+
+#Output- Prints one line per record.
+###############################################################
+
+def bench_table(records):
+
+	print("%-32s %-9s %9s %9s  %s" % ("Data", "Comp", "Build", "Solve",
+		"Objectives"))
+	for rec in records:
+		if rec['error'] is not None:
+			print("%-32s %-9s %s" % (rec['data'], rec['comp'],
+				rec['error'][:60]))
+			continue
+		print("%-32s %-9s %9.3f %9.3f  %s" % (rec['data'], rec['comp'],
+			rec['build'], sum(rec['solve']),
+			" ".join("-" if o is None else "%.6g" % o for o in rec['obj'])))
+
+
+###############################################################
+#Benchmark Column-and-Constraint Table
+
+# bench_ccg_table(records)
+
+#Input-	Records. Output of bench_ccg.
+
+#Output- Prints one line per record.
+###############################################################
+
+def bench_ccg_table(records):
+
+	print("%-32s %-10s %9s %5s %14s %14s" % ("Data", "Mode", "Time",
+		"Iters", "LB", "UB"))
+	for rec in records:
+		if rec['error'] is not None:
+			print("%-32s %-10s %s" % (rec['data'], rec['mode'],
+				rec['error'][:60]))
+			continue
+		print("%-32s %-10s %9.3f %5d %14.8g %14.8g" % (rec['data'],
+			rec['mode'], rec['time'], rec['iters'], rec['lb'], rec['ub']))
+
+
+###############################################################
+#Benchmark Suite Table
+
+# bench_suite_table(suite)
+
+#Input-	Suite. Output of bench_suite.
+
+#Output- Prints one line per dataset, with the median of its runs,
+#		 or the first error if every run failed.
+###############################################################
+
+def bench_suite_table(suite):
+
+	def median(vals):
+		vals = sorted(vals)
+		return (vals[(len(vals) - 1) // 2] + vals[len(vals) // 2]) / 2.0
+
+	print("%-32s %4s %9s %9s %9s %5s %10s %9s" % ("Data", "Runs", "Build",
+		"Solve", "Total", "Iters", "Gap", "RSS MB"))
+	data = []
+	for rec in suite['runs']:
+		if rec['data'] not in data:
+			data.append(rec['data'])
+	for path in data:
+		runs = [rec for rec in suite['runs'] if rec['data'] == path]
+		good = [rec for rec in runs if rec['error'] is None]
+		if not good:
+			print("%-32s %4d %s" % (path, 0, runs[0]['error'][:60]))
+			continue
+		rss = [rec['rss'] for rec in good if rec['rss'] is not None]
+		print("%-32s %4d %9.3f %9.3f %9.3f %5d %10.3g %9s" % (path,
+			len(good), median([rec['build'] for rec in good]),
+			median([rec['solve'] for rec in good]),
+			median([rec['total'] for rec in good]),
+			median([rec['iters'] for rec in good]),
+			median([rec['gap'] for rec in good]),
+			"%.1f" % median(rss) if rss else "-"))
+
+
+if __name__ == '__main__':
+	args = sys.argv[1:]
+	what = (args.pop(0) if args and args[0] in ('comp', 'ccg', 'suite')
+			else 'comp')
+	if what == 'suite':
+		records = bench_suite()
+		bench_suite_table(records)
+	elif what == 'ccg':
+		records = bench_ccg()
+		bench_ccg_table(records)
+	else:
+		records = bench_comp()
+		bench_table(records)
+	if args:
+		with open(args[0], 'w') as f:
+			json.dump(records, f, indent=1, sort_keys=True)
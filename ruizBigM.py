@@ -0,0 +1,135 @@
+#######################################################################
+#Big Ms of the Subproblem
+
+#Computes a big M for each complementarity constraint of the
+#subproblem from the node and line data, in place of the single Mgen,
+#Mdem, Mcap and Mtheta read from the data file. Each M bounds the
+#slack of its own primal constraint, so it is always valid and is
+#as small as the data allows:
+#	genpos - gen, gen 			<= supmax[i]
+#	dem - unmet, unmet 			<= demmax[i]
+#	cap*x -/+ tran 				<= 2 * cap[l] * maxLines
+#	pi -/+ theta 				<= 2 * pi
+#The duals have no such bound from the data alone, so their Ms start
+#at the user M, and can be tightened later by ruizOBBT. See m_dual.
+
+#Input–	(From models) The subproblem model under construction.
+
+#Output- (To models) Rules to initialize the per-constraint Ms.
+#		 (To main) A report of the Ms against the user-supplied ones.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import value
+import ruizC as RC
+import math
+
+
+###############################################################
+#Big M Rules
+
+#Input-	Mod. The subproblem model under construction.
+#		I. The node or line of the constraint.
+
+#Output- The M of the constraint. The user M if RC.TIGHTM is off.
+###############################################################
+
+def m_gen(mod, i):
+	if not RC.TIGHTM:
+		return mod.Mgen
+	return mod.supmax[i]
+
+def m_dem(mod, i):
+	if not RC.TIGHTM:
+		return mod.Mdem
+	return mod.demmax[i]
+
+def m_cap(mod, i, j):
+	if not RC.TIGHTM:
+		return mod.Mcap
+	return 2 * mod.cap[i,j] * mod.maxLines
+
+def m_theta(mod, i):
+	if not RC.TIGHTM:
+		return mod.Mtheta
+	return 2 * math.pi
+
+###############################################################
+#Big M of the Duals
+
+#The Lagrangian rows tie the duals of the generation and shedding
+#rows to the price flow_dual[i] of their node:
+#	genmax_dual - genmin_dual 		= flow_dual[i] - sigma*gencost[i]
+#	unmetmax_dual - unmetmin_dual 	= flow_dual[i] - sigma*shed[i]
+#so sigma*gencost and sigma*shed would bound them only if every price
+#were in [0, sigma * largest cost]. It is not: a loop of lines, or an
+#angle limit that binds, lets one more unit at a node relieve a line
+#for several units elsewhere, and prices go above the largest shed
+#cost or below zero. On small meshed and radial networks with the
+#rows of ruizDisp there are scenarios where EVERY optimal dual breaks
+#such a bound, so a cost M would cut off every KKT point and the
+#subproblem would lose its worst case. The line and angle duals are
+#differences of prices, with no bound either.
+###############################################################
+
+def m_dual(mod, *i):
+	return mod.M
+
+
+#Per-constraint Ms of the subproblem, the user M they replace
+#and the rule that sets them
+MS = (	('Mgenmax', 'Mgen', m_gen), ('Mgenmin', 'Mgen', m_gen),
+		('Munmetmax', 'Mdem', m_dem), ('Munmetmin', 'Mdem', m_dem),
+		('Mcapmax', 'Mcap', m_cap), ('Mcapmin', 'Mcap', m_cap),
+		('Mthetamax', 'Mtheta', m_theta), ('Mthetamin', 'Mtheta', m_theta),
+		('Mgenmax_dual', 'M', m_dual), ('Mgenmin_dual', 'M', m_dual),
+		('Munmetmax_dual', 'M', m_dual), ('Munmetmin_dual', 'M', m_dual),
+		('Mcapmax_dual', 'M', m_dual), ('Mcapmin_dual', 'M', m_dual),
+		('Mthetamax_dual', 'M', m_dual), ('Mthetamin_dual', 'M', m_dual))
+
+
+###############################################################
+#Big M Reset
+
+# bigm_reset(isub)
+
+#Input-	Isub. The concrete version of the subproblem.
+
+#Output- Makes changes in the "isub" instance
+#
+# Sets every per-constraint M back to the value of its rule, undoing
+# any tightening that was only valid for an earlier design.
+###############################################################
+
+def bigm_reset(isub):
+
+	for name, user, rule in MS:
+		param = getattr(isub, name)
+		for i in param:
+			idx = i if isinstance(i, tuple) else (i,)
+			param[i] = value(rule(isub, *idx))
+
+
+###############################################################
+#Big M Report
+
+# bigm_report(isub)
+
+#Input-	Isub. The concrete version of the subproblem.
+
+#Output- List of (M, user M, smallest M, largest M) for each family
+#		 of per-constraint Ms. Also printed as a table.
+###############################################################
+
+def bigm_report(isub):
+
+	report = []
+	print("%-16s %14s %14s %14s" % ("Big M", "User", "Min", "Max"))
+	for name, user, rule in MS:
+		ms = [value(m) for m in getattr(isub, name).values()]
+		if not ms:
+			continue
+		row = (name, value(getattr(isub, user)), min(ms), max(ms))
+		report.append(row)
+		print("%-16s %14.6g %14.6g %14.6g" % row)
+	return report
@@ -12,7 +12,34 @@
 SOLVER = "cplex"			#Solver to use
 EPSILON = 1e-7				#Distance between up and lower bound to halt
 DATA = "data.dat"			#Problem data file 
-UNCTOL = -1e-12			    #Tolerance to use for uncertainity denominators
+UNCTOL = 1e-9				#Tolerance to use for uncertainity denominators
 MIPGAP = 1e-12				#Solver Gap in mixed integer problem
+REUSESUB = True				#Build subproblem once, then only update x_star
+DROPLINES = True			#Leave unbuilt lines out of the subproblem
+TIGHTM = True				#Big M of each constraint from the data
+OBBT = False				#Tighten the big Ms with LPs for each design
+WORKERS = 4					#Processes to use for parallel work
+COMP = "bigm"				#Complementarity in subproblem: bigm, sos1, indicator
+PERSISTENT = True			#Keep the master loaded in a persistent solver
+PSOLVER = "cplex_persistent"	#Persistent solver to use
+ENGINE = "kkt"				#Subproblem engine: kkt (ruizSub), dual (ruizDual)
+SUBSTART = True				#Start each subproblem from the last worst case
+MASTSTART = True			#Start each master from the incumbent design
+SCENTOL = 1e-6				#Scenarios that round to this are the same
+AGE = 0						#Master solves a block can be slack, 0 to keep all
+TOPK = 1					#Worst cases to add to the master per iteration
+TOPDIST = 0.05				#Least move between them, part of the total range
+POOLK = 1					#Designs of the master's pool to try as UB
+BENDERS = False				#Also add a Benders cut on eta per worst case
+ADAPTGAP = False			#Loose MIP gaps at first, tighter as bounds meet
+GAPMAX = 0.05				#Loosest MIP gap, of the first solves
+GAPRATE = 0.1				#MIP gap as a part of (UB-LB)/UB
+TIMELIMIT = 0				#Seconds for the whole run, 0 for no limit
+TIMESHARE = 0.5				#Part of the time left each solve may take
+CHECKPOINT = ""				#File to save the run to each iteration, or ""
+PAUSE = True				#Wait for enter after each solve in main
+VERBOSE = True				#Print every subproblem variable, and any
+							#repeated scenario, each iteration
+XSTAR = None				#Lines at start as START_X_STAR, None for main's
 
 
@@ -0,0 +1,156 @@
+#######################################################################
+#Checkpoints of the Column-and-Constraint Method
+
+#Saves the state of a run of ruizMain after each iteration, so a run
+#that dies can go on from its last iteration. The state is small:
+#the scenarios in P, the bounds, the designs and the settings. The
+#master is not saved, it is built again from its scenarios with
+#mast_func, and no subproblem is solved again.
+
+#The file is a pickle of plain Python values, written to a temporary
+#file first and then moved over the old one, so a run that dies while
+#writing leaves the last checkpoint whole.
+
+#Input–	(From main) The master and the state of the loop.
+#		(From user) python ruizMain.py resume run.ckpt
+#		or python ruizCkpt.py run.ckpt to print what one holds.
+
+#Output- (To main) The state and the rebuilt master, to go on from.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+import ruizC as RC
+import ruizMast as m
+import os
+import pickle
+import sys
+
+VERSION = 1			#Format of the checkpoint file
+
+
+###############################################################
+#Checkpoint Save
+
+# ckpt_save(fname, imast, state)
+
+#Input-	Fname. File to write.
+#		Imast. The concrete version of the master problem.
+#		State. Dictionary of the state of the loop of main
+#			k 		- Last iteration done
+#			LB, UB 	- Bounds after it
+#			best 	- Design of UB, in the form of START_X_STAR
+#			scens 	- Worst cases not yet in the master, as from
+#					  sub_topk
+#			history - List of (k, LB, UB) of every iteration
+#			gap 	- MIP gap of the next solves
+#			exact 	- If the MIP gap is fixed at RC.MIPGAP
+#			x_star 	- START_X_STAR of the run
+
+#Output- Writes the file. Adds to "state"
+#			P 		- List of (k, {node: demand}, {node: possible gen})
+#					  of every scenario in the master, in order
+#			design 	- Design of the last master solve
+#			cuts 	- Benders cuts of the master (see mast_cut)
+#			settings - Every constant of RC
+###############################################################
+
+def ckpt_save(fname, imast, state):
+
+	scen = getattr(imast, '_scen', None) or {}
+	state = dict(state)
+	state['version'] = VERSION
+	state['P'] = [(p, scen[p][0], scen[p][1]) for p in imast.P]
+	state['design'] = [(i, j, int(round(value(imast.x[i,j], exception=False)
+										or 0))) for i, j in imast.L]
+	state['cuts'] = list(getattr(imast, '_cuts', None) or [])
+	state['settings'] = dict((name, val) for name, val in vars(RC).items()
+							 if name.isupper())
+	state['settings']['DATA'] = os.path.abspath(RC.DATA)
+
+	temp = fname + '.tmp'
+	with open(temp, 'wb') as f:
+		pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(temp, fname)
+
+
+###############################################################
+#Checkpoint Load
+
+# ckpt_load(fname)
+
+#Input-	Fname. File written by ckpt_save.
+
+#Output- The state, as in ckpt_save.
+###############################################################
+
+def ckpt_load(fname):
+
+	with open(fname, 'rb') as f:
+		state = pickle.load(f)
+	if state.get('version') != VERSION:
+		raise ValueError("Checkpoint " + fname + " is of version "
+						 + str(state.get('version')) + ", not "
+						 + str(VERSION))
+	return state
+
+
+###############################################################
+#Checkpoint Settings
+
+# ckpt_settings(state)
+
+#Input-	State. Output of ckpt_load.
+
+#Output- Puts the constants of RC back as they were in the run.
+#
+# Call before anything reads RC, so the run goes on as it started.
+# Solvers made when their module was imported keep the solver of
+# this run.
+###############################################################
+
+def ckpt_settings(state):
+
+	for name, val in state['settings'].items():
+		setattr(RC, name, val)
+
+
+###############################################################
+#Checkpoint Master
+
+# ckpt_master(state, data)
+
+#Input-	State. Output of ckpt_load.
+#		Data. Parsed data of the run, from ruizData.
+
+#Output- A new master with every scenario and cut of the checkpoint,
+#		 and x at the design of its last solve, ready for mast_start.
+#
+# Each scenario goes through mast_func with its own index. The
+# master has no solver yet, so its first solve loads it whole.
+# Blocks that mast_age had set aside are all back in.
+###############################################################
+
+def ckpt_master(state, data):
+
+	imast = m.mod.create_instance(data)
+	for i, j, n in state['x_star']:
+		imast.x_star[i,j] = n
+	for p, dem, genpos in state['P']:
+		m.mast_func(imast, dem, genpos, state['x_star'], p)
+	for cut in state['cuts']:
+		m.mast_row(imast, cut)
+	for i, j, n in state['design']:
+		imast.x[i,j].set_value(n)
+	return imast
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		sys.exit("usage: python ruizCkpt.py run.ckpt")
+	state = ckpt_load(sys.argv[1])
+	print("Iteration", state['k'], "of", state['settings']['DATA'])
+	print("LB", state['LB'], "UB", state['UB'])
+	print("Scenarios", len(state['P']), "Waiting", len(state['scens']),
+		  "Cuts", len(state['cuts']))
+	print("Best design", state['best'])
@@ -0,0 +1,52 @@
+#######################################################################
+#Problem Data
+
+#Parses an AMPL-style data file one time and hands the same loaded
+#data to every model built from it. The master and the subproblem
+#declare the same sets and parameters, so one parse serves both of
+#them, and every later instance, for as long as the file is unchanged.
+
+#Input–	(From main) Path of the data file. See docs/Input.pdf.
+
+#Output- (To main) A Pyomo DataPortal for use in create_instance.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+import ruizC as RC
+import ruizSub as s
+import os
+
+_DATA = {}		#Loaded data, keyed by (path, modified time)
+
+
+###############################################################
+#Data Load
+
+# data_load(path)
+
+#Input-	Path. The data file. Defaults to RC.DATA.
+
+#Output- DataPortal with the data of the file.
+#
+# The file is only parsed again if it is modified on disk.
+###############################################################
+
+def data_load(path=None):
+
+	if path is None:
+		path = RC.DATA
+	path = os.path.abspath(path)
+	key = (path, os.path.getmtime(path))
+
+	if key not in _DATA:
+		#Drop older versions of the same file
+		for old in [k for k in _DATA if k[0] == path]:
+			del _DATA[old]
+
+		#Subproblem model gives the dimension of each parameter
+		data = DataPortal(model=s.mod)
+		data.load(filename=path)
+		_DATA[key] = data
+
+	return _DATA[key]
@@ -0,0 +1,185 @@
+#######################################################################
+#Dispatch of a Scenario
+
+#Solves the innermost problem on its own: the least cost dispatch
+#(generation, load shed, flows and angles) for a fixed scenario of
+#demand and possible generation on a fixed design. It is a small LP,
+#and is used to build feasible starting points for the subproblem
+#and the master from a scenario that is already known.
+
+#The LP has the rows of the subproblem. The lines that may carry flow
+#and the lines whose flow follows the angles can be given apart, as
+#the master limits flow by x but ties it to the angles by x_star.
+
+#Input–	(From subproblem or master) A concrete instance for the sets
+#		and data, the scenario and the design.
+#		(From master) A design at which to cut the hourly costs.
+
+#Output- (To subproblem or master) The dispatch values.
+#		 (To master) A Benders cut on the hourly costs, from the duals.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+from pyomo.opt import SolverFactory, TerminationCondition
+import ruizC as RC
+import ruizNet as RN
+import math
+import weakref
+
+opt = SolverFactory(RC.SOLVER)
+_DISPS = weakref.WeakKeyDictionary()		#Dispatch model of each instance
+
+
+###############################################################
+#Dispatch Model
+
+# disp_model(inst)
+
+#Input-	Inst. A concrete master or subproblem instance.
+
+#Output- The dispatch LP for the network and data of "inst", with
+#		 mutable dem, genpos, xcap and xphys.
+#
+# Built once per instance and kept for it, so later scenarios only
+# change the parameters. It is not a block of "inst", so it is never
+# written to the solver with it.
+###############################################################
+
+def disp_model(inst):
+
+	if inst in _DISPS:
+		return _DISPS[inst]
+
+	N, L, G, D = list(inst.N), list(inst.L), list(inst.G), list(inst.D)
+	net = RN.net_of(inst)
+	ref = value(inst.ref)
+
+	disp = ConcreteModel()
+	disp.dem 	= Param(D, mutable=True, initialize=0)	#Demand
+	disp.genpos = Param(G, mutable=True, initialize=0)	#Possible Gen
+	disp.xcap 	= Param(L, mutable=True, initialize=0)	#Lines for capacity
+	disp.xphys 	= Param(L, mutable=True, initialize=0)	#Lines for angles
+
+	disp.gen 	= Var(G, domain=NonNegativeReals)
+	disp.unmet 	= Var(D, domain=NonNegativeReals)
+	disp.tran 	= Var(L, within=Reals)
+	disp.theta 	= Var(N, bounds=(-math.pi, math.pi))
+
+	#min sigma * [gen_cost * generation + shed_cost * unfilled_demand]
+	disp.Obj = Objective(expr=value(inst.sigma)
+		* (sum(value(inst.gencost[i]) * disp.gen[i] for i in G)
+		 + sum(value(inst.shed[i]) * disp.unmet[i] for i in D)))
+
+	disp.GenConstraint = Constraint(G,
+		rule=lambda d, i: d.gen[i] <= d.genpos[i])
+	disp.UnmetConstraint = Constraint(D,
+		rule=lambda d, i: d.unmet[i] <= d.dem[i])
+	disp.CapConstraint = Constraint(L,
+		rule=lambda d, *l: (-value(inst.cap[l]) * d.xcap[l], d.tran[l],
+							value(inst.cap[l]) * d.xcap[l]))
+
+	def flow_rule(d, i):
+		gen = d.gen[i] if i in G else 0
+		dem = d.dem[i] if i in D else 0
+		unmet = d.unmet[i] if i in D else 0
+		return (sum(d.tran[l] for l in net['in'][i])
+			- sum(d.tran[l] for l in net['out'][i]) + gen - dem == -unmet)
+	disp.FlowConstraint = Constraint(N, rule=flow_rule)
+
+	def theta_rule(d, i, j):
+		return (value(inst.b[i,j]) * (d.theta[i] - d.theta[j]) * d.xphys[i,j]
+			== d.tran[i,j])
+	disp.ThetaConstraint = Constraint(L, rule=theta_rule)
+	disp.RefConstraint = Constraint(expr=disp.theta[ref] == 0)
+
+	#Duals, for disp_cut
+	disp.dual = Suffix(direction=Suffix.IMPORT)
+
+	_DISPS[inst] = disp
+	return disp
+
+
+###############################################################
+#Dispatch Solve
+
+# disp_solve(inst, dem, genpos, xcap, xphys)
+
+#Input-	Inst. A concrete master or subproblem instance.
+#		Dem. Demand at each node with demand.
+#		Genpos. Possible generation at each generator.
+#		Xcap. Lines built on each route.
+#		Xphys. Lines whose flow follows the angles. Defaults to xcap.
+
+#Output- The solved dispatch model, or None if it is not optimal.
+###############################################################
+
+def disp_solve(inst, dem, genpos, xcap, xphys=None):
+
+	if xphys is None:
+		xphys = xcap
+	disp = disp_model(inst)
+	for i in disp.dem:
+		disp.dem[i] = value(dem[i])
+	for i in disp.genpos:
+		disp.genpos[i] = value(genpos[i])
+	for l in disp.xcap:
+		disp.xcap[l] = value(xcap[l])
+		disp.xphys[l] = value(xphys[l])
+
+	results = opt.solve(disp)
+	if (results.solver.termination_condition
+		!= TerminationCondition.optimal):
+		return None
+	return disp
+
+
+###############################################################
+#Dispatch Values
+
+# disp_values(disp)
+
+#Input-	Disp. A solved dispatch model, from disp_solve.
+
+#Output- Dictionary of gen, unmet, tran, theta --> {index: value}
+#
+# Angles of nodes that no built line reaches are in no row of the
+# LP and have no value, so they are left out.
+###############################################################
+
+DISPVARS = ('gen', 'unmet', 'tran', 'theta')
+
+def disp_values(disp):
+
+	return dict((name, dict((i, v.value) for i, v in getattr(disp, name).items()
+							if v.value is not None))
+				for name in DISPVARS)
+
+
+###############################################################
+#Dispatch Cut
+
+# disp_cut(inst, dem, genpos, xcap, xphys)
+
+#Input-	Inst, Dem, Genpos, Xcap, Xphys. As disp_solve.
+
+#Output- (const, {line: coef}) so that for every xcap
+#			hourly costs >= const + sum(coef * xcap)
+#		 or None if the dispatch is not optimal.
+#
+# xcap is only in the right hand side of the capacity rows, so the
+# duals of one solve stay feasible for every xcap, and the dual
+# objective is a lower bound on the cost there, equal at "xcap".
+# A capacity row is ranged, -cap*x <= tran <= cap*x, and its one dual
+# is for the side that binds, so either way it is -|dual| * cap.
+###############################################################
+
+def disp_cut(inst, dem, genpos, xcap, xphys=None):
+
+	disp = disp_solve(inst, dem, genpos, xcap, xphys)
+	if disp is None:
+		return None
+	coef = dict((l, -abs(disp.dual.get(disp.CapConstraint[l], 0))
+				 * value(inst.cap[l])) for l in disp.xcap)
+	const = value(disp.Obj) - sum(coef[l] * value(disp.xcap[l]) for l in coef)
+	return const, coef
@@ -0,0 +1,466 @@
+#######################################################################
+#Strong Duality Subproblem Abstract Model
+
+#A second engine for the subproblem of the column-and-constraint method.
+#Like ruizSub, it finds the worst-case realization of demand and
+#possible generation for a design x_star, but it replaces the
+#innermost minimization with the strong duality equality instead of
+#the KKT conditions:
+#	primal feasibility, dual feasibility, and
+#	primal cost = dual objective
+#so there are no complementarity pairs, and no binary for each of them.
+
+#The dual objective has bilinear terms of each dual times an uncertain
+#parameter (flow_dual * dem, genmax_dual * genpos). The uncertainty
+#budget sets are
+#	sum(dem - demmin) = uncD * sum(demmax - demmin)
+#	sum(supmax - genpos) = uncS * sum(supmax - supmin)
+#inside the boxes, and the dual objective is linear in them for fixed
+#duals, so the worst case is at an extreme point of the budget set.
+#At an extreme point every node is at one end of its range except at
+#most one, which takes what is left of the budget. Each node has
+#two binaries, for being at the far end of its range or being the
+#one fractional node, and each product of a binary and a dual is
+#linearized exactly. The bounds on the duals come from the
+#Lagrangian constraints and the dual M of the data.
+
+#Exposes the same dem, genpos and Obj as ruizSub, and the same
+#sub_func and sub_solve, so main can use either engine (RC.ENGINE).
+
+#Input– (From main) X_star. The set of built lines from the master.
+#		(From data file) AMPL style data for a concrete model.
+#			See docs/Input.pdf for more.
+
+#Output- (To main) Results of a Pyomo.opt.solve.
+#				   Value of maximization as a possible upper bound
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+from pyomo.opt import SolverFactory, SolverStatus
+import ruizC as RC
+import ruizNet as RN
+import ruizSub as s
+import ruizDisp as RDI
+import math
+
+mod = AbstractModel()
+opt = SolverFactory(RC.SOLVER)
+opt.options['mipgap'] = RC.MIPGAP
+
+###############################################################
+#Parameters and Sets
+###############################################################
+
+#Sets
+mod.N = 	Set()						#Nodes
+mod.L = 	Set(within=mod.N*mod.N)		#Lines
+
+#Parameters
+mod.c = 		Param(mod.L)			#Cost per line
+mod.cap =		Param(mod.L)			#Line capacity
+mod.b =			Param(mod.L)			#Phyiscs on each line
+mod.pi = 		Param()					#Budget
+mod.maxLines =	Param()					#Max Lines per route
+mod.sigma = 	Param()					#Hours in a year
+mod.demmax = 	Param(mod.N)			#Maximum possible Demand
+mod.demmin = 	Param(mod.N)			#Minimum possible Demand
+mod.supmax = 	Param(mod.N)			#Maximum possible Supply
+mod.supmin = 	Param(mod.N)			#Minimum possible Supply
+mod.gencost =	Param(mod.N)			#Cost to generate
+mod.shed =  	Param(mod.N)			#Load Shedding Cost Per Node
+mod.uncD =  	Param()					#Uncertainty in Demand
+mod.uncS =  	Param()					#Uncertainty in Supply
+mod.ref	=		Param()					#Reference Theta
+
+#Big Ms
+mod.M	=		Param()					#Max M for Duals
+mod.Mgen =		Param()					#Highest Gen Possible
+mod.Mdem =		Param()					#Highest Demand Possible
+mod.Mcap = 		Param()					#Highest Line Capacity
+mod.Mtheta = 	Param()					#7 since 7 > 2pi
+mod.Mtran = 	Param()					#Most that can be transmitted
+
+#Parameters that come from Master
+mod.x_star = 	Param(mod.L, domain=NonNegativeIntegers, default=0,
+	mutable = True) 					#Built Lines
+
+#Derived Sets
+mod.G = 	Set(within=mod.N, initialize=RN.gen_nodes)	#Nodes that generate
+mod.D = 	Set(within=mod.N, initialize=RN.dem_nodes)	#Nodes with demand
+
+#Range of each uncertain parameter, and the budget to spread over them
+def dem_range(mod, i):
+	return mod.demmax[i] - mod.demmin[i]
+mod.demrange =	Param(mod.D, initialize=dem_range)
+def sup_range(mod, i):
+	return mod.supmax[i] - mod.supmin[i]
+mod.suprange =	Param(mod.G, initialize=sup_range)
+def dem_budget(mod):
+	return mod.uncD * sum(mod.demmax[i] - mod.demmin[i] for i in mod.N)
+mod.demBudget =	Param(initialize=dem_budget)
+def sup_budget(mod):
+	return mod.uncS * sum(mod.supmax[i] - mod.supmin[i] for i in mod.N)
+mod.supBudget =	Param(initialize=sup_budget)
+
+
+###############################################################
+#Variables
+###############################################################
+
+#Primal Variables, as in ruizSub
+mod.tran   = Var(mod.L, within=Reals) 			 #Ammount Transmitted
+mod.dem    = Var(mod.D, domain=NonNegativeReals) #Demand
+mod.genpos = Var(mod.G, domain=NonNegativeReals) #Max Possible Gen
+mod.gen    = Var(mod.G, domain=NonNegativeReals) #Generation
+mod.unmet  = Var(mod.D, domain=NonNegativeReals) #Unfilled Demand
+mod.theta = Var(mod.N,bounds=(-math.pi, math.pi))
+
+#Dual Variables, as in ruizSub
+mod.genmax_dual	  =	Var(mod.G, domain=NonNegativeReals) #[Phi^(E.max)]
+mod.genmin_dual	  =	Var(mod.G, domain=NonNegativeReals) #[Phi^(E.min)]
+mod.unmetmax_dual = Var(mod.D, domain=NonNegativeReals) #[Phi^(D.max)]
+mod.unmetmin_dual = Var(mod.D, domain=NonNegativeReals) #[Phi^(D.min)]
+mod.thetamax_dual = Var(mod.N, domain=NonNegativeReals) #[Phi^(N.max)]
+mod.thetamin_dual = Var(mod.N, domain=NonNegativeReals) #[Phi^(N.min)]
+mod.capmax_dual   =	Var(mod.L, domain=NonNegativeReals) #[Phi^(L.max)]
+mod.capmin_dual   =	Var(mod.L, domain=NonNegativeReals) #[Phi^(L.min)]
+mod.theta_dual 	  = Var(mod.L) 							#[Phi^(L)]
+mod.flow_dual 	  =	Var(mod.N) 							#[Lambda]
+mod.ref_dual	  = Var()								#[Chi^Ref]
+
+#Coefficient of each uncertain parameter in the dual objective
+#	dem:	Flow_Dual - UnmetMax_Dual = Sigma * Shed - UnmetMin_Dual
+#	genpos:	-GenMax_Dual
+#bounded by the Lagrangian constraints and the dual M
+def coef_dem_bounds(mod, i):
+	return (mod.sigma * mod.shed[i] - mod.M, mod.sigma * mod.shed[i])
+mod.coef_dem = Var(mod.D, bounds=coef_dem_bounds)
+def coef_sup_bounds(mod, i):
+	return (-mod.M, 0)
+mod.coef_sup = Var(mod.G, bounds=coef_sup_bounds)
+
+#Extreme point of the budget sets
+mod.y_dem = Var(mod.D, domain=Binary)				#Demand at max
+mod.v_dem = Var(mod.D, domain=Binary)				#Fractional node
+mod.r_dem = Var(mod.D, domain=NonNegativeReals)		#Fractional part
+mod.y_sup = Var(mod.G, domain=Binary)				#Supply at min
+mod.v_sup = Var(mod.G, domain=Binary)				#Fractional node
+mod.r_sup = Var(mod.G, domain=NonNegativeReals)		#Fractional part
+
+#Products in the dual objective
+#	p = y * coef, 	w = v * coef,
+#	f = sum(w) (coef of the fractional node), 	q = y * f
+def frac_bounds(cbounds, nodes):
+	def bounds_rule(mod):
+		bounds = [cbounds(mod, i) for i in getattr(mod, nodes)]
+		return (min([0] + [lo for lo, hi in bounds]),
+				max([0] + [hi for lo, hi in bounds]))
+	return bounds_rule
+
+mod.p_dem = Var(mod.D)
+mod.w_dem = Var(mod.D)
+mod.f_dem = Var(bounds=frac_bounds(coef_dem_bounds, 'D'))
+mod.q_dem = Var(mod.D)
+mod.p_sup = Var(mod.G)
+mod.w_sup = Var(mod.G)
+mod.f_sup = Var(bounds=frac_bounds(coef_sup_bounds, 'G'))
+mod.q_sup = Var(mod.G)
+
+
+#############################################
+#Functions
+#############################################
+
+#Dual objective, the cost of dispatch for the worst case
+#	sum(coef_dem * dem) + sum(coef_sup * genpos)
+#	- sum(cap * x * (CapMax_Dual + CapMin_Dual))
+#	- pi * sum(ThetaMax_Dual + ThetaMin_Dual)
+#where with dem = demmin + range * y + r and r only at the node with v,
+#	sum(coef_dem * dem) = sum(coef_dem * demmin)
+#		+ sum(range * p) + budget * f - sum(range * q)
+#and genpos = supmax - range * y - r the same with signs flipped
+def dual_cost(mod):
+	return (sum(mod.coef_dem[i] * mod.demmin[i]
+				+ mod.demrange[i] * (mod.p_dem[i] - mod.q_dem[i])
+				for i in mod.D)
+		+ mod.demBudget * mod.f_dem
+		+ sum(mod.coef_sup[i] * mod.supmax[i]
+				- mod.suprange[i] * (mod.p_sup[i] - mod.q_sup[i])
+				for i in mod.G)
+		- mod.supBudget * mod.f_sup
+		- sum(mod.cap[l] * mod.x_star[l]
+				* (mod.capmax_dual[l] + mod.capmin_dual[l]) for l in mod.L)
+		- math.pi * sum(mod.thetamax_dual[i] + mod.thetamin_dual[i]
+				for i in mod.N))
+
+#Objective Function
+#	max [dual cost] + c^t*x
+def obj_expression(mod):
+	return dual_cost(mod) + sum(mod.c[j] * mod.x_star[j] for j in mod.L)
+mod.Obj = Objective(rule=obj_expression, sense = maximize)
+
+
+#Strong Duality
+#	sigma * [gen_cost * generation + shed_cost * unfilled_demand]
+#		= [dual cost]
+def strong_duality_rule(mod):
+	return (mod.sigma * (sum(mod.gencost[i] * mod.gen[i] for i in mod.G)
+		 + sum(mod.shed[i] * mod.unmet[i] for i in mod.D))
+		 == dual_cost(mod))
+mod.StrongDualityConstraint = Constraint(rule=strong_duality_rule)
+
+
+#Primal feasibility, the rows of ruizSub
+mod.MaxGenConstraint = Constraint(mod.G, rule=s.max_gen_rule)
+mod.UnmetConstraint = Constraint(mod.D, rule=s.unmet_rule)
+mod.CapConstraint = Constraint(mod.L, rule=s.cap_rule)
+mod.FlowConstraint = Constraint(mod.N, rule=s.flow_rule)
+mod.ThetaConstraint = Constraint(mod.L, rule=s.theta_rule)
+mod.RefConstraint = Constraint(rule=s.ref_rule)
+
+
+#Dual feasibility, the Lagrangian rows of ruizSub
+mod.LagrangianGenConstraint = Constraint(mod.G, rule=s.lag_gen)
+mod.LagrangianUnmetConstraint = Constraint(mod.D, rule=s.lag_unmet)
+mod.LagrangianTransConstraint = Constraint(mod.L, rule=s.lag_trans)
+mod.LagrangianThetaConstraint = Constraint(mod.N, rule=s.lag_theta)
+
+
+#Coefficients of the uncertain parameters
+def coef_dem_rule(mod, i):
+	return mod.coef_dem[i] == mod.flow_dual[i] - mod.unmetmax_dual[i]
+mod.CoefDemConstraint = Constraint(mod.D, rule=coef_dem_rule)
+def coef_sup_rule(mod, i):
+	return mod.coef_sup[i] == -mod.genmax_dual[i]
+mod.CoefSupConstraint = Constraint(mod.G, rule=coef_sup_rule)
+
+###############################
+#Uncertainty Budgets
+###############################
+
+#Demand at an extreme point of its budget set
+#	dem = demmin + range * y + r
+#	sum(range * y + r) = budget
+#	r <= range * v,		y + v <= 1,		sum(v) <= 1
+def dem_point_rule(mod, i):
+	return (mod.dem[i] == mod.demmin[i] + mod.demrange[i] * mod.y_dem[i]
+		+ mod.r_dem[i])
+mod.DemPointConstraint = Constraint(mod.D, rule=dem_point_rule)
+def dem_budget_rule(mod):
+	return (sum(mod.demrange[i] * mod.y_dem[i] + mod.r_dem[i]
+		for i in mod.D) == mod.demBudget)
+mod.UncDemConstraint = Constraint(rule=dem_budget_rule)
+def dem_frac_rule(mod, i):
+	return mod.r_dem[i] <= mod.demrange[i] * mod.v_dem[i]
+mod.DemFracConstraint = Constraint(mod.D, rule=dem_frac_rule)
+def dem_end_rule(mod, i):
+	return mod.y_dem[i] + mod.v_dem[i] <= 1
+mod.DemEndConstraint = Constraint(mod.D, rule=dem_end_rule)
+def dem_one_rule(mod):
+	return sum(mod.v_dem[i] for i in mod.D) <= 1
+mod.DemOneConstraint = Constraint(rule=dem_one_rule)
+
+
+#Possible generation at an extreme point of its budget set
+#	genpos = supmax - range * y - r
+#	sum(range * y + r) = budget
+#	r <= range * v,		y + v <= 1,		sum(v) <= 1
+def sup_point_rule(mod, i):
+	return (mod.genpos[i] == mod.supmax[i] - mod.suprange[i] * mod.y_sup[i]
+		- mod.r_sup[i])
+mod.SupPointConstraint = Constraint(mod.G, rule=sup_point_rule)
+def sup_budget_rule(mod):
+	return (sum(mod.suprange[i] * mod.y_sup[i] + mod.r_sup[i]
+		for i in mod.G) == mod.supBudget)
+mod.UncSupConstraint = Constraint(rule=sup_budget_rule)
+def sup_frac_rule(mod, i):
+	return mod.r_sup[i] <= mod.suprange[i] * mod.v_sup[i]
+mod.SupFracConstraint = Constraint(mod.G, rule=sup_frac_rule)
+def sup_end_rule(mod, i):
+	return mod.y_sup[i] + mod.v_sup[i] <= 1
+mod.SupEndConstraint = Constraint(mod.G, rule=sup_end_rule)
+def sup_one_rule(mod):
+	return sum(mod.v_sup[i] for i in mod.G) <= 1
+mod.SupOneConstraint = Constraint(rule=sup_one_rule)
+
+###############################
+#Exact Linearization
+###############################
+
+#Product of a binary and a bounded variable, prod = binary * cont
+#	lo * binary <= prod <= hi * binary
+#	cont - hi * (1 - binary) <= prod <= cont - lo * (1 - binary)
+#Exact, since the binary is 0 or 1
+def product(prod, binary, cont):
+	def product_rule(mod, i, n):
+		p, z, c = prod(mod, i), binary(mod, i), cont(mod, i)
+		if n == 1:
+			return p >= c.lb * z
+		if n == 2:
+			return p <= c.ub * z
+		if n == 3:
+			return p >= c - c.ub * (1 - z)
+		return p <= c - c.lb * (1 - z)
+	return product_rule
+
+mod.FOUR = RangeSet(4)
+
+mod.PDemConstraint = Constraint(mod.D, mod.FOUR, rule=product(
+	lambda m, i: m.p_dem[i], lambda m, i: m.y_dem[i],
+	lambda m, i: m.coef_dem[i]))
+mod.WDemConstraint = Constraint(mod.D, mod.FOUR, rule=product(
+	lambda m, i: m.w_dem[i], lambda m, i: m.v_dem[i],
+	lambda m, i: m.coef_dem[i]))
+mod.QDemConstraint = Constraint(mod.D, mod.FOUR, rule=product(
+	lambda m, i: m.q_dem[i], lambda m, i: m.y_dem[i],
+	lambda m, i: m.f_dem))
+def f_dem_rule(mod):
+	return mod.f_dem == sum(mod.w_dem[i] for i in mod.D)
+mod.FDemConstraint = Constraint(rule=f_dem_rule)
+
+mod.PSupConstraint = Constraint(mod.G, mod.FOUR, rule=product(
+	lambda m, i: m.p_sup[i], lambda m, i: m.y_sup[i],
+	lambda m, i: m.coef_sup[i]))
+mod.WSupConstraint = Constraint(mod.G, mod.FOUR, rule=product(
+	lambda m, i: m.w_sup[i], lambda m, i: m.v_sup[i],
+	lambda m, i: m.coef_sup[i]))
+mod.QSupConstraint = Constraint(mod.G, mod.FOUR, rule=product(
+	lambda m, i: m.q_sup[i], lambda m, i: m.y_sup[i],
+	lambda m, i: m.f_sup))
+def f_sup_rule(mod):
+	return mod.f_sup == sum(mod.w_sup[i] for i in mod.G)
+mod.FSupConstraint = Constraint(rule=f_sup_rule)
+
+
+
+###############################################################
+#Subproblem Function
+
+# sub_func(isub, x)
+
+#Input- Isub. The concrete version of this subproblem.
+#		X. Lines built on each route. Usually imast.x from the master.
+
+#Output- Makes changes in the "isub" instance
+#
+# Same as ruizSub.sub_func, for the per-line components of this model.
+###############################################################
+
+#Components of a line that only matter if the line is built
+LINEVARS = ('tran', 'theta_dual', 'capmax_dual', 'capmin_dual')
+LINECONS = ('CapConstraint', 'ThetaConstraint', 'LagrangianTransConstraint')
+
+def sub_func(isub, x):
+	s.sub_func(isub, x, LINEVARS, LINECONS)
+
+
+###############################################################
+#Subproblem Start
+
+# sub_start(isub, dem, genpos)
+
+#Input- Isub. The concrete version of this subproblem, with x_star set.
+#		Dem, Genpos. The last worst case.
+
+#Output- Values of the variables of "isub" for a MIP start.
+#		 False if no start could be made.
+#
+# As ruizSub.sub_start. The binaries here are those of the extreme
+# point the last worst case is at, and do not depend on the design.
+###############################################################
+
+def sub_start(isub, dem, genpos):
+
+	disp = RDI.disp_solve(isub, dem, genpos, isub.x_star)
+	if disp is None:
+		return False
+	vals = RDI.disp_values(disp)
+
+	for v in isub.component_data_objects(Var):
+		if not v.fixed:
+			v.value = None
+
+	for i in isub.D:
+		isub.dem[i].set_value(value(dem[i]), skip_validation=True)
+		extreme_point(isub.y_dem[i], isub.v_dem[i], isub.r_dem[i],
+			value(dem[i]) - value(isub.demmin[i]), value(isub.demrange[i]))
+	for i in isub.G:
+		isub.genpos[i].set_value(value(genpos[i]), skip_validation=True)
+		extreme_point(isub.y_sup[i], isub.v_sup[i], isub.r_sup[i],
+			value(isub.supmax[i]) - value(genpos[i]), value(isub.suprange[i]))
+	for name in RDI.DISPVARS:
+		var = getattr(isub, name)
+		for i, val in vals[name].items():
+			if not var[i].fixed:
+				var[i].set_value(val, skip_validation=True)
+	return True
+
+#Binaries of a node with deviation "dev" out of its range "full"
+def extreme_point(y, v, r, dev, full):
+	y.set_value(int(full > 0 and dev >= full - RC.EPSILON * (1 + full)))
+	v.set_value(int(not y.value and dev > RC.EPSILON * (1 + full)))
+	r.set_value(dev if v.value else 0, skip_validation=True)
+
+
+###############################################################
+#Subproblem Solve
+
+# sub_solve(isub, warmstart, load_solutions, gap)
+
+#Input- Isub. The concrete version of this subproblem.
+#		Warmstart. Pass the values in "isub" as a MIP start.
+#		Load_solutions. Load the solution into "isub".
+#		Gap. Relative MIP gap of the solve. Defaults to RC.MIPGAP.
+#		Timelimit. Seconds the solve may take, or None for no limit.
+
+#Output- Results of the solve. The solution is loaded into "isub",
+#		 if the solve found one. See ruizSub.sub_solve.
+###############################################################
+
+def sub_solve(isub, warmstart=False, load_solutions=True, gap=None,
+			  timelimit=None):
+	if gap is None:
+		gap = RC.MIPGAP
+	if timelimit is None:
+		return opt.solve(isub, warmstart=warmstart,
+						 load_solutions=load_solutions,
+						 options={'mipgap': gap})
+	results = opt.solve(isub, warmstart=warmstart, load_solutions=False,
+						options={'mipgap': gap, 'timelimit': timelimit})
+	if load_solutions and results.solver.status != SolverStatus.error:
+		isub.solutions.load_from(results)
+	return results
+
+#As ruizSub.sub_bound
+def sub_bound(isub, results):
+	return s.sub_bound(isub, results)
+
+
+###############################################################
+#Subproblem Top K
+
+# sub_topk(isub, k, gap, limit)
+
+#Input- Isub. The concrete version of this subproblem, solved.
+#		K. Number of worst cases wanted.
+#		Gap, Limit. As ruizSub.sub_topk.
+
+#Output- As ruizSub.sub_topk. The no-good cuts are on the extreme
+#		 point binaries, so each re-solve is at a new vertex of the
+#		 budget sets.
+###############################################################
+
+#Binaries of the extreme point
+BINARIES = ('y_dem', 'v_dem', 'y_sup', 'v_sup')
+
+def sub_topk(isub, k, gap=None, limit=None):
+	return s.sub_topk(isub, k, sub_solve, sub_nogood, gap, limit)
+
+#No-good cut of the extreme point in isub, None if it has no binaries
+def sub_nogood(isub):
+	zs = [z for name in BINARIES for z in getattr(isub, name).values()]
+	if not zs:
+		return None
+	return (sum(1 - z for z in zs if z.value > 0.5)
+		+ sum(z for z in zs if z.value <= 0.5) >= 1)
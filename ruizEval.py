@@ -0,0 +1,179 @@
+#######################################################################
+#Design Evaluation
+
+#Finds the worst-case cost of given designs with the subproblem, in
+#a pool of processes. Each process parses the data and builds the
+#subproblem once, then only changes x_star between designs.
+
+#Designs are given as in START_X_STAR of ruizMain, a list of
+#(source, dest, lines built).
+
+#Input–	(From main) Path of the data file and the designs.
+#		(From user) Data file, file of designs and optional workers.
+#		python ruizEval.py data.dat designs.txt [workers]
+#		The designs file is a Python list of designs, each a list of
+#		tuples as START_X_STAR.
+
+#Output- (To main) One result per design, as each one finishes.
+#		 (To user) One JSON line per design, as each one finishes.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+from pyomo.opt import SolverStatus, TerminationCondition
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ruizC as RC
+import ruizSub
+import ruizDual
+import ruizData as RD
+import ast
+import json
+import os
+import sys
+import time
+
+_SUBS = {}		#Subproblem of this process, keyed by (path, engine)
+
+
+###############################################################
+#Evaluate Design
+
+# eval_design(path, design, gap, timelimit)
+
+#Input-	Path. The data file.
+#		Design. List of (source, dest, lines built). Routes that are
+#			not in the list have no lines.
+#		Gap. Relative MIP gap of the solve. Defaults to RC.MIPGAP.
+#		Timelimit. Seconds the solve may take, or None for no limit.
+
+#Output- Dictionary of
+#			design 		- The design given
+#			obj 		- Worst-case cost, lines and hourly costs.
+#						  None if the subproblem found no worst case
+#			bound 		- Upper bound on the worst-case cost, see
+#						  ruizSub.sub_bound. None with obj
+#			dem, genpos - Worst case, as {node: value}
+#			status 		- Termination condition of the solve
+#			time 		- Seconds taken
+#
+# Run inside a worker, or in this process.
+###############################################################
+
+def eval_design(path, design, gap=None, timelimit=None):
+
+	start = time.time()
+	sub = ruizDual if RC.ENGINE == "dual" else ruizSub
+
+	#Subproblem of this process, built again if the data changed
+	path = os.path.abspath(path)
+	data = RD.data_load(path)
+	key = (path, RC.ENGINE)
+	if key not in _SUBS or _SUBS[key][0] is not data:
+		_SUBS[key] = (data, sub.mod.create_instance(data))
+	isub = _SUBS[key][1]
+
+	x = dict((l, 0) for l in isub.L)
+	for i, j, n in design:
+		x[i,j] = n
+	sub.sub_func(isub, x)
+	results = sub.sub_solve(isub, load_solutions=False, gap=gap,
+							timelimit=timelimit)
+
+	#A solve stopped by its time limit keeps the worst case it found
+	cond = results.solver.termination_condition
+	res = {'design': [tuple(d) for d in design], 'obj': None, 'bound': None,
+		   'dem': None, 'genpos': None, 'status': str(cond), 'time': None}
+	if (results.solver.status != SolverStatus.error
+		and cond in (TerminationCondition.optimal,
+					 TerminationCondition.maxTimeLimit)):
+		if len(results.solution):
+			isub.solutions.load_from(results)
+		res['obj'] = value(isub.Obj)
+		res['bound'] = sub.sub_bound(isub, results)
+		res['dem'] = dict((i, value(isub.dem[i])) for i in isub.D)
+		res['genpos'] = dict((i, value(isub.genpos[i])) for i in isub.G)
+	res['time'] = time.time() - start
+	return res
+
+
+###############################################################
+#Evaluate Pool
+
+# eval_pool(path, designs, pool, gap, timelimit)
+
+#Input-	Path. The data file.
+#		Designs. List of designs, each as in eval_design.
+#		Pool. A concurrent.futures executor of processes.
+#		Gap, Timelimit. As eval_design, for every design.
+
+#Output- Iterator over the results of eval_design, in the order they
+#		 finish. Each also has "index", the place of its design in
+#		 "designs".
+#
+# Every design is handed to the pool before this returns, so the
+# caller can do other work while they run.
+###############################################################
+
+def eval_pool(path, designs, pool, gap=None, timelimit=None):
+
+	futures = dict((pool.submit(eval_design, path, d, gap, timelimit), n)
+				   for n, d in enumerate(designs))
+	return (dict(f.result(), index=futures[f]) for f in as_completed(futures))
+
+
+###############################################################
+#Evaluate Designs
+
+# eval_designs(path, designs, workers)
+
+#Input-	Path. The data file.
+#		Designs. List of designs, each as in eval_design.
+#		Workers. Processes to use.
+
+#Output- Iterator over the results of eval_pool, in the order they
+#		 finish.
+#
+# The pool is made for this batch and closed once every result has
+# been read.
+###############################################################
+
+def eval_designs(path, designs, workers=RC.WORKERS):
+
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		for res in eval_pool(path, designs, pool):
+			yield res
+
+
+###############################################################
+#Read Designs
+
+# eval_read(fname)
+
+#Input-	Fname. File holding a Python list of designs, each a list of
+#			(source, dest, lines built) as START_X_STAR. Lines
+#			starting with # are comments.
+
+#Output- The list of designs.
+###############################################################
+
+def eval_read(fname):
+
+	with open(fname) as f:
+		text = "".join(line for line in f
+					   if not line.lstrip().startswith('#'))
+	designs = ast.literal_eval(text)
+	for d in designs:
+		for t in d:
+			if len(t) != 3:
+				raise ValueError("design entry %r is not (source, dest, lines)"
+								 % (t,))
+	return designs
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 3:
+		sys.exit("usage: python ruizEval.py data.dat designs.txt [workers]")
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else RC.WORKERS
+	for res in eval_designs(sys.argv[1], eval_read(sys.argv[2]), workers):
+		print(json.dumps(res))
+		sys.stdout.flush()
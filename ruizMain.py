@@ -18,18 +18,93 @@ from pyomo.environ import *
 from pyomo.opt import SolverFactory
 from pyomo.opt import SolverStatus, TerminationCondition
 import ruizC as RC
-import ruizSub as s
+import ruizSub
+import ruizDual
 import ruizMast as m
+import ruizData as RD
+import ruizBigM as RB
+import ruizOBBT as RO
+import ruizEval as RE
+import ruizCkpt as RK
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+import time
 
 STOP = 8							#How many iterations to quit after
 startlines = True					#If possible lines at start
 LB = float("-inf")					#Upper Bound
 UB = float("inf")					#Lower Bound
 
-#Lines At Start
+#Design to start each master from, in the form of START_X_STAR
+#None to start from the design of the last master
+MAST_DESIGN = None
+
+#Lines At Start, RC.XSTAR if it is given
 START_X_STAR = [(1,2,1), (1,3,1), (1,4,0), (1,5,0), (1,6,0),
 				(2,3,0), (2,4,0), (2,5,0), (2,6,0), (3,4,0),
 				(3,5,0), (3,6,0), (4,5,1), (4,6,0), (5,6,0)]
+if RC.XSTAR is not None:
+	START_X_STAR = [tuple(x) for x in RC.XSTAR]
+
+#Seconds spent building instances, in master and subproblem solves,
+#and in all
+times = {'build': 0.0, 'master': 0.0, 'sub': 0.0, 'total': 0.0}
+begin = time.time()
+
+#Checkpoint to go on from, "python ruizMain.py resume run.ckpt"
+#Its settings are put back before anything else reads them
+RESUME = sys.argv[2] if sys.argv[1:2] == ['resume'] else None
+ckpt = RESUME and RK.ckpt_load(RESUME)
+if ckpt:
+	RK.ckpt_settings(ckpt)
+	START_X_STAR = ckpt['x_star']
+
+#Subproblem engine, KKT (ruizSub) or strong duality (ruizDual)
+#Only the KKT engine has big Ms to report and tighten
+s = ruizDual if RC.ENGINE == "dual" else ruizSub
+KKT = s is ruizSub
+
+#Parse the data once for every master and subproblem instance
+clock = time.time()
+data = RD.data_load(RC.DATA)
+times['build'] += time.time() - clock
+
+#The master's pool is only read from a persistent CPLEX, see mast_pool
+if RC.POOLK > 1 and not (RC.PERSISTENT and RC.PSOLVER == "cplex_persistent"):
+	raise ValueError("RC.POOLK > 1 needs RC.PERSISTENT with "
+					 "RC.PSOLVER = 'cplex_persistent'")
+
+#Processes for the other designs of the master's pool and for the
+#bound tightening LPs, kept for the whole run
+pool = None
+if RC.POOLK > 1 or (RC.OBBT and KKT and RC.WORKERS > 1):
+	pool = ProcessPoolExecutor(max_workers=RC.WORKERS)
+
+#MIP gap of the solves. With RC.ADAPTGAP it starts loose and follows
+#the gap between the bounds, which come from the solvers' best bounds
+gap = RC.GAPMAX if RC.ADAPTGAP else RC.MIPGAP
+exact = not RC.ADAPTGAP
+
+#End of the time budget, RC.TIMELIMIT, if there is one
+deadline = time.time() + RC.TIMELIMIT if RC.TIMELIMIT else None
+
+#Time limit of the next solve, RC.TIMESHARE of the time left
+#If a solve of step zero finds nothing in it there is no design to
+#give, and the run ends with none
+def limit():
+	if deadline is None:
+		return None
+	return max(0, RC.TIMESHARE * (deadline - time.time()))
+
+#Best design found, in the form of START_X_STAR, and its worst case
+#cost is UB
+best = None
+UB = float('inf')
+
+#(k, LB, UB) of every iteration, step zero as 0
+history = []
+first = 1
 
 ############################
 #Step Zero Master
@@ -37,17 +112,35 @@ START_X_STAR = [(1,2,1), (1,3,1), (1,4,0), (1,5,0), (1,6,0),
 #If there are lines at the start then find the cost of them
 #This provides an absolute lower bound of the optimization
 #Else the Lower Bound is zero	
-if (startlines):
+#A resumed run builds the master again from the scenarios of its
+#checkpoint, and the loop goes on after its last iteration
+if ckpt:
+	clock = time.time()
+	imast = RK.ckpt_master(ckpt, data)
+	times['build'] += time.time() - clock
+	LB, UB, best, scens = ckpt['LB'], ckpt['UB'], ckpt['best'], ckpt['scens']
+	gap, exact, history = ckpt['gap'], ckpt['exact'], ckpt['history']
+	first = ckpt['k'] + 1
+
+elif (startlines):
 	#create step zero		
-	imast = m.mod.create_instance(RC.DATA)
+	clock = time.time()
+	imast = m.mod.create_instance(data)
+	times['build'] += time.time() - clock
 		
 	#Set x_star in step zero
 	for x in START_X_STAR:
 		imast.x_star[x[0], x[1]] = x[2]
 	
 	#solve step zero
-	zresults = m.opt.solve(imast)
-	LB = value(imast.Obj)
+	clock = time.time()
+	zresults = m.mast_solve(imast, gap=gap, timelimit=limit())
+	times['master'] += time.time() - clock
+	if zresults.solver.status == SolverStatus.error:
+		print("Out of time, the master found no design")
+		LB, first = 0, STOP + 1
+	else:
+		LB = m.mast_bound(imast, zresults)
 
 	'''
 	print("\n\n***MASTER ZERO***\n\n")
@@ -68,15 +161,38 @@ else:
 #Step Zero Subproblem
 ############################
 #Create subproblem
-isub = s.mod.create_instance(RC.DATA)
+clock = time.time()
+isub = s.mod.create_instance(data)
+times['build'] += time.time() - clock
+
+#Compare the big Ms of each constraint to the ones in the data
+if RC.TIGHTM and KKT:
+	RB.bigm_report(isub)
+
+#A resumed run already has its bounds and worst cases, and a run out
+#of time has no design to solve for
+if not ckpt and first <= STOP:
+	#Set x_star in subproblem
+	s.sub_func(isub, imast.x)
 
-#Set x_star in subproblem
-for xi in imast.x:
-	isub.x_star[xi] = int(round(value(imast.x[xi])))
+	#Tighten the big Ms for this design
+	if RC.OBBT and KKT:
+		RO.obbt_apply(isub, RO.obbt(RC.DATA, imast.x, pool, isub))
 		
-#solve subproblem
-sresults = s.opt.solve(isub)
-UB = value(isub.Obj)
+	#solve subproblem
+	clock = time.time()
+	sresults = s.sub_solve(isub, gap=gap, timelimit=limit())
+	if sresults.solver.status == SolverStatus.error:
+		print("Out of time, the subproblem found no worst case")
+		first = STOP + 1
+	else:
+		UB = s.sub_bound(isub, sresults)
+		best = [(i, j, int(round(value(isub.x_star[i,j])))) for i, j in isub.L]
+
+		#Worst cases for the master, the best RC.TOPK of them
+		scens = s.sub_topk(isub, RC.TOPK, gap=gap, limit=limit)
+	times['sub'] += time.time() - clock
+	history.append((0, LB, UB))
 
 '''
 print("\n\n***SUB ZERO***\n\n")
@@ -94,20 +210,70 @@ input()
 ############################
 #Main Loop
 ############################
-for k in range(1,STOP+1):
+for k in range(first,STOP+1):
 	
 	#If UB and LB close enough, quit loop
 	if (UB - LB) / UB <= RC.EPSILON:
 		break
+
+	#Out of time, the best design so far stands
+	if deadline is not None and time.time() >= deadline:
+		print("Out of time")
+		break
+
+	if not exact:
+		gap = min(RC.GAPMAX, max(RC.MIPGAP, RC.GAPRATE * (UB - LB) / UB))
 	
 	########################
 	#STEP K Master Problem
 	######################## 
-	m.mast_func(imast, isub.dem, isub.genpos, START_X_STAR, k)
+	#A worst case the master already has means the design will not
+	#change, so stop. If it was found at a loose gap, solve exactly
+	#from now on first, as a tighter solve may still find more
+	old = len(imast.P)
+	obj, dem, genpos = scens[0]
+	p = m.mast_func(imast, dem, genpos, START_X_STAR, old + 1)
+	if p:
+		if RC.VERBOSE:
+			print("Scenario", old + 1, "repeats scenario", p)
+		if exact:
+			print("Converged, the worst case is already in the master")
+			break
+		print("Worst case repeats at a loose gap, solving exactly")
+		exact, gap = True, RC.MIPGAP
+
+	#The other worst cases go in the same iteration
+	for obj, dem, genpos in scens[1:]:
+		k = len(imast.P) + 1
+		p = m.mast_func(imast, dem, genpos, START_X_STAR, k)
+		if p and RC.VERBOSE:
+			print("Scenario", k, "repeats scenario", p)
+
+	#A Benders cut for each new worst case, at the last design
+	if RC.BENDERS:
+		for p in list(imast.P)[old:]:
+			m.mast_cut(imast, p, imast.x)
+
+	#Start from the incumbent design, or the user's one
+	design = MAST_DESIGN and dict(((i,j), n) for i, j, n in MAST_DESIGN)
+	start = RC.MASTSTART and m.mast_start(imast, design)
 
 	#solve master problem
-	mresults = m.opt.solve(imast)
-	LB = value(imast.Obj)
+	clock = time.time()
+	mresults = m.mast_solve(imast, warmstart=start, gap=gap,
+		timelimit=limit())
+
+	#Bring back blocks set aside that the solution violates, then set
+	#aside the ones that have been slack for long enough
+	if RC.AGE:
+		while m.mast_revive(imast):
+			mresults = m.mast_solve(imast, gap=gap, timelimit=limit())
+		m.mast_age(imast)
+	times['master'] += time.time() - clock
+	if mresults.solver.status == SolverStatus.error:
+		print("Out of time, the master found no design")
+		break
+	LB = max(LB, m.mast_bound(imast, mresults))
 	
 	print('\n\nk:', k)
 	print("*MASTER*\n\n")
@@ -120,36 +286,81 @@ for k in range(1,STOP+1):
 			print ("   ",index, varob[index].value)
 	#imast.pprint()
 	'''
-	input()
+	if RC.PAUSE:
+		input()
 
 	########################
 	#STEP K Sub roblem
 	########################
-	#Create subproblem
-	isub = s.mod.create_instance(RC.DATA)
+	#Create subproblem, or reuse the one already built
+	if not RC.REUSESUB:
+		clock = time.time()
+		isub = s.mod.create_instance(data)
+		times['build'] += time.time() - clock
+
+	#Other designs of the master's pool, run while this one is solved
+	others = []
+	if pool is not None:
+		others = RE.eval_pool(RC.DATA, m.mast_pool(imast, RC.POOLK - 1), pool,
+							  gap, limit())
 
 	#Set x_star in sub
-	for xi in imast.x:
-		isub.x_star[xi] = int(round(value(imast.x[xi])))
+	s.sub_func(isub, imast.x)
+	if RC.OBBT and KKT:
+		RO.obbt_apply(isub, RO.obbt(RC.DATA, imast.x, pool, isub))
+
+	#Start from the worst case of the last subproblem, repaired for the
+	#new design. imast.dem and imast.genpos hold whichever scenario the
+	#master took in last, which with RC.TOPK or a pool is another one
+	obj, dem, genpos = scens[0]
+	start = RC.SUBSTART and s.sub_start(isub, dem, genpos)
 
 	#solve subproblem
-	sresults = s.opt.solve(isub)
+	clock = time.time()
+	sresults = s.sub_solve(isub, warmstart=start, gap=gap,
+		timelimit=limit())
+	if sresults.solver.status == SolverStatus.error:
+		print("Out of time, the subproblem found no worst case")
+		break
+	scens = s.sub_topk(isub, RC.TOPK, gap=gap, limit=limit)
+	times['sub'] += time.time() - clock
 	
 	print('\n\nk:', k)
 	print("*SUB***\n\n")
-	sresults.write()
-	for v in isub.component_objects(Var, active=True):
-		print ("Variable",v)
-		varob = getattr(isub, str(v))
-		for index in varob:
-			print ("   ",index, varob[index].value)
+	if RC.VERBOSE:
+		sresults.write()
+		for v in isub.component_objects(Var, active=True):
+			print ("Variable",v)
+			varob = getattr(isub, str(v))
+			for index in varob:
+				print ("   ",index, varob[index].value)
 	#isub.pprint()
-	input()	
+	if RC.PAUSE:
+		input()
 	
 	#store new upper bound if it is < previous upper bound
-	if value (isub.Obj) <= UB:
+	if s.sub_bound(isub, sresults) <= UB:
 		print("UPDATE UB")
-		UB = value(isub.Obj)
+		UB = s.sub_bound(isub, sresults)
+		best = [(i, j, int(round(value(isub.x_star[i,j])))) for i, j in isub.L]
+
+	#Each design of the pool is also an upper bound, and its worst
+	#case goes to the master with the others
+	for res in others:
+		if res['obj'] is None:
+			continue
+		scens.append((res['obj'], res['dem'], res['genpos']))
+		if res['bound'] <= UB:
+			print("UPDATE UB FROM POOL")
+			UB = res['bound']
+			best = res['design']
+	history.append((k, LB, UB))
+
+	#Everything needed to go on from here, see ruizCkpt
+	if RC.CHECKPOINT:
+		RK.ckpt_save(RC.CHECKPOINT, imast, {'k': k, 'LB': LB, 'UB': UB,
+			'best': best, 'scens': scens, 'history': history, 'gap': gap,
+			'exact': exact, 'x_star': START_X_STAR})
 	
 	print("XXX")
 	print(UB)
@@ -157,8 +368,21 @@ for k in range(1,STOP+1):
 	print(UB - LB)
 	print((UB-LB)/ UB)
 	print("XXX")
-	
-	
+
+if pool is not None:
+	pool.shutdown()
+
+#Best design found, and how far from the best possible it can be
+GAP = (UB - LB) / UB if best is not None else float('inf')
+print("BEST DESIGN")
+print(best)
+print("UB", UB, "LB", LB, "GAP", GAP)
+
+#Record of the run, for ruizBatch and ruizBench
+times['total'] = time.time() - begin
+RESULT = {'data': os.path.abspath(RC.DATA), 'lb': LB, 'ub': UB,
+		  'gap': GAP, 'iters': history[-1][0] if history else 0,
+		  'design': best, 'history': history, 'times': times}
 	
 	
 '''
@@ -29,8 +29,10 @@
 
 # -*- coding: utf-8 -*-
 from pyomo.environ import *
-from pyomo.opt import SolverFactory
+from pyomo.opt import SolverFactory, SolverStatus
 import ruizC as RC
+import ruizNet as RN
+import ruizDisp as RDI
 import math
 
 mod = AbstractModel()					#name of model
@@ -79,6 +81,10 @@ mod.genpos = Param(mod.N, default=0, mutable = True)	#Maximum Supply
 mod.x_star = Param(mod.L, domain=NonNegativeIntegers, default=0,
 	mutable = True) 									#Built Lines
 
+#Derived Sets
+mod.G = 	Set(within=mod.N, initialize=RN.gen_nodes)	#Nodes that generate
+mod.D = 	Set(within=mod.N, initialize=RN.dem_nodes)	#Nodes with demand
+
 ###############################################################
 #Variables
 ###############################################################
@@ -101,11 +107,11 @@ mod.route_on =	Var(mod.L, domain=Binary, initialize=0)
 #Ammount Transmitted
 mod.tran = Var(mod.P, mod.L, within=Reals, initialize=0)
 
-#Generation Supply	
-mod.gen  =	Var(mod.P, mod.N, domain=NonNegativeReals, initialize=0)
+#Generation Supply (only at nodes that generate)
+mod.gen  =	Var(mod.P, mod.G, domain=NonNegativeReals, initialize=0)
 	
-#Unfilled Demand	
-mod.unmet = Var(mod.P, mod.N, domain=NonNegativeReals, initialize=0)
+#Unfilled Demand (only at nodes with demand)
+mod.unmet = Var(mod.P, mod.D, domain=NonNegativeReals, initialize=0)
 
 #Angle in [-pi,pi]	
 mod.theta = Var(mod.P, mod.N, bounds=(-math.pi, math.pi), initialize=0)	
@@ -165,6 +171,15 @@ mod.ThetaConstraint 	= ConstraintList()
 mod.EtaConstraint 		= ConstraintList()
 mod.RefConstraint 		= ConstraintList()
 
+#Names of the expanding constraints, in the order they are filled
+EXPANDING = ('GenConstraint', 'UnmetDemConstraint', 'CapConstraintPos',
+			'CapConstraintNeg', 'FlowConstraint', 'ThetaConstraint',
+			'EtaConstraint', 'RefConstraint')
+
+#Benders cuts on eta, one row each (see mast_cut). They are never
+#set aside with the blocks
+mod.BendersConstraint 	= ConstraintList()
+
 
 
 
@@ -181,14 +196,32 @@ mod.RefConstraint 		= ConstraintList()
 #		K. What iteration the main is currently on.
 
 #Output- Makes changes in the "imast" function
+#		 The earlier scenario this one repeats, or None.
 #
 # This function adds a new series of constraints based on the
 # generation and supply level found from the previous subproblem
-# solve. 
+# solve. The scenario is also kept in imast._scen[k] as
+# ({node: demand}, {node: possible generation}).
+#
+# A scenario that rounds to one already in P (see mast_key) would
+# only add a copy of its block, so nothing is added for it. The
+# master already holds that worst case, so its next solution would
+# not change.
 ###############################################################
 
 def mast_func(imast, subdem, subgenpos, in_x_star, k):
-	
+
+	#Skip a scenario that is already in the master
+	if getattr(imast, '_keys', None) is None:
+		imast._keys = {}
+	key = mast_key(imast, subdem, subgenpos)
+	if key in imast._keys:
+		return imast._keys[key]
+	imast._keys[key] = k
+
+	#Size of each expanding constraint before this block
+	size = dict((c, len(getattr(imast, c))) for c in EXPANDING)
+
 	#Add to set P that there is a new subproblem solved
 	imast.P.add(k)
 	
@@ -200,18 +233,25 @@ def mast_func(imast, subdem, subgenpos, in_x_star, k):
 	for i in subgenpos:
 		imast.genpos[i] = value(subgenpos[i])
 
+	#Keep the scenario of block k
+	if getattr(imast, '_scen', None) is None:
+		imast._scen = {}
+	imast._scen[k] = (dict((i, value(subdem[i])) for i in imast.D),
+					  dict((i, value(subgenpos[i])) for i in imast.G))
+	imast._fresh = getattr(imast, '_fresh', set()) | set([k])
+
 	#Set x_star
 	for x in in_x_star:
 		imast.x_star[x[0], x[1]] = x[2]
 
 	#Supply min and max
 	#	Gen <= (Possible_Generation)
-	for i in subgenpos:
+	for i in imast.G:
 		imast.GenConstraint.add( imast.gen[k,i] <= value(subgenpos[i]))
 		
 	#Unmet Demand is less than Demand
 	#	("Unmet Demand") <= demand
-	for i in subdem:
+	for i in imast.D:
 		imast.UnmetDemConstraint.add( imast.unmet[k,i]
 			<= value(subdem[i]))
 
@@ -226,13 +266,14 @@ def mast_func(imast, subdem, subgenpos, in_x_star, k):
 	#Flow (Supply and Demand)
 	#	Flow + Generation - Demand >= (-1)*("Unmet Demand")
 	#Flow is positive if from Node 1 to 2, and negative if Node 2 to 1	
+	net = RN.net_of(imast)
 	for i in imast.N:
-		flowcol = sum(imast.tran[k,j,j2] for (j,j2) in imast.L
-			if (j2 == i))
-		flowrow = sum(imast.tran[k,j,j2] for (j,j2) in imast.L
-			if (j == i))
+		flowcol = sum(imast.tran[k,j,j2] for (j,j2) in net['in'][i])
+		flowrow = sum(imast.tran[k,j,j2] for (j,j2) in net['out'][i])
+		gen = imast.gen[k,i] if i in imast.G else 0
+		unmet = imast.unmet[k,i] if i in imast.D else 0
 		imast.FlowConstraint.add( flowcol - flowrow
-			+ imast.gen[k,i] - imast.dem[i] >= -imast.unmet[k,i])
+			+ gen - value(imast.dem[i]) >= -unmet)
 
 	# Theta Rules
 	# Theta is the angle at each node
@@ -246,12 +287,464 @@ def mast_func(imast, subdem, subgenpos, in_x_star, k):
 	#	Eta >= sigma * [(Generation_Costs) + (Load_Shedding)]
 	# Sigma is hours in a year
 	imast.EtaConstraint.add( imast.sigma * 
-		(sum(imast.gencost[i] * imast.gen[k,i] for i in imast.N) 
-		+ sum(imast.shed[i] * imast.unmet[k,i] for i in imast.N))
+		(sum(imast.gencost[i] * imast.gen[k,i] for i in imast.G) 
+		+ sum(imast.shed[i] * imast.unmet[k,i] for i in imast.D))
 		<= imast.eta)
 
 	# Reference Theta
 	#	Theta refernce = 0 for each k 
 	imast.RefConstraint.add(imast.theta[k,value(imast.ref)] == 0)
+
+	#Rows of block k, so it can be handled on its own later
+	if getattr(imast, '_rows', None) is None:
+		imast._rows = {}
+	imast._rows[k] = dict((c, range(size[c] + 1, len(getattr(imast, c)) + 1))
+						  for c in EXPANDING)
+
+	#Hand only the new block to a persistent solver
+	mast_push(imast, k)
+	return None
+
+
+###############################################################
+#Master Key
+
+# mast_key(imast, subdem, subgenpos)
+
+#Input- Imast. The concrete version of the master problem.
+#		Subdem, Subgenpos. A scenario, as given to mast_func.
+
+#Output- Hashable key of the scenario. Each value is rounded to a
+#		 multiple of RC.SCENTOL, so scenarios that only differ by
+#		 solver noise share a key.
+###############################################################
+
+def mast_key(imast, subdem, subgenpos):
+
+	return (tuple(int(round(value(subdem[i]) / RC.SCENTOL))
+				for i in imast.D),
+			tuple(int(round(value(subgenpos[i]) / RC.SCENTOL))
+				for i in imast.G))
+
+
+###############################################################
+#Master Block
+
+# mast_block(imast, k)
+
+#Input- Imast. The concrete version of the master problem.
+#		K. A scenario in P.
+
+#Output- The variables and the rows of the block of scenario k.
+###############################################################
+
+def mast_block(imast, k):
+
+	var = ([imast.tran[k,l] for l in imast.L]
+		+ [imast.gen[k,i] for i in imast.G]
+		+ [imast.unmet[k,i] for i in imast.D]
+		+ [imast.theta[k,i] for i in imast.N])
+	con = [getattr(imast, c)[n] for c in EXPANDING
+		   for n in imast._rows[k][c]]
+	return var, con
+
+
+###############################################################
+#Master Push
+
+# mast_push(imast, k)
+
+#Input- Imast. The concrete version of the master problem.
+#		K. The scenario whose block was just added, or brought back.
+
+#Output- Changes in the persistent solver holding "imast", if any
+#
+# The persistent solver keeps the master loaded between solves, so
+# only the variables and constraints of scenario k are added to it.
+###############################################################
+
+def mast_push(imast, k):
+
+	if getattr(imast, '_popt', None) is None:
+		return
+
+	#Variables first, so the rows can refer to them
+	var, con = mast_block(imast, k)
+	for v in var:
+		imast._popt.add_var(v)
+	for c in con:
+		imast._popt.add_constraint(c)
+
+
+###############################################################
+#Master Pull
+
+# mast_pull(imast, k)
+
+#Input- Imast. The concrete version of the master problem.
+#		K. A scenario whose block is set aside.
+
+#Output- Changes in the persistent solver holding "imast", if any
+#
+# The reverse of mast_push. Rows go first, so no row is left with a
+# variable that is gone.
+###############################################################
+
+def mast_pull(imast, k):
+
+	if getattr(imast, '_popt', None) is None:
+		return
+
+	var, con = mast_block(imast, k)
+	for c in con:
+		imast._popt.remove_constraint(c)
+	for v in var:
+		imast._popt.remove_var(v)
+
+
+###############################################################
+#Master Cost
+
+# mast_cost(imast, k)
+
+#Input- Imast. The concrete version of the master problem.
+#		K. A scenario in P.
+
+#Output- Hourly costs of the dispatch in the block of scenario k.
+#		 The left hand side of its row in EtaConstraint.
+###############################################################
+
+def mast_cost(imast, k):
+
+	return value(imast.sigma) * (
+		sum(value(imast.gencost[i]) * value(imast.gen[k,i]) for i in imast.G)
+		+ sum(value(imast.shed[i]) * value(imast.unmet[k,i])
+			for i in imast.D))
+
+
+###############################################################
+#Master Cut
+
+# mast_cut(imast, k, design)
+
+#Input- Imast. The concrete version of the master problem.
+#		K. A scenario in P.
+#		Design. Lines built on each route, where the cut is tight.
+#			Usually imast.x, the design the scenario was found for.
+
+#Output- Makes changes in the "imast" function
+#		 The cut, as in RDI.disp_cut, or None if none was added.
+#
+# Adds the Benders cut of scenario k at "design" to BendersConstraint
+#	eta >= const + sum(coef * x)
+# Block k also holds the dispatch of scenario k, and bounds eta at
+# least as tightly. The cut is one row, so it keeps bounding eta
+# after mast_age sets the block aside. It is made from the duals of
+# the dispatch LP of the block, with flow tied to the angles by
+# x_star, so it is valid for every x the master can choose.
+###############################################################
+
+def mast_cut(imast, k, design):
+
+	dem, genpos = imast._scen[k]
+	cut = RDI.disp_cut(imast, dem, genpos, design, imast.x_star)
+	if cut is None:
+		return None
+	mast_row(imast, cut)
+	return cut
+
+#Adds a cut (const, coef) to BendersConstraint, and keeps it in
+#imast._cuts
+def mast_row(imast, cut):
+	const, coef = cut
+	imast.BendersConstraint.add(imast.eta
+		>= const + sum(coef[l] * imast.x[l] for l in imast.L if coef[l]))
+	if getattr(imast, '_cuts', None) is None:
+		imast._cuts = []
+	imast._cuts.append(cut)
+
+	if getattr(imast, '_popt', None) is not None:
+		row = imast.BendersConstraint[len(imast.BendersConstraint)]
+		imast._popt.add_constraint(row)
+
+
+###############################################################
+#Master Age
+
+# mast_age(imast)
+
+#Input- Imast. The concrete version of the master problem, solved.
+
+#Output- Scenarios set aside in this call.
+#
+# A block whose eta row is slack does not bound the master at its
+# solution. Each block counts the master solves in a row it has been
+# slack for. After RC.AGE of them, its rows are deactivated and it
+# is taken out of the persistent solver. Its scenario is still
+# kept, and mast_revive brings it back if it is needed again.
+###############################################################
+
+def mast_age(imast):
+
+	if getattr(imast, '_age', None) is None:
+		imast._age = {}
+		imast._off = set()
+
+	eta = value(imast.eta)
+	aged = []
+	for p in imast.P:
+		if p in imast._off:
+			continue
+		slack = eta - mast_cost(imast, p)
+		if slack > RC.EPSILON * (1 + abs(eta)):
+			imast._age[p] = imast._age.get(p, 0) + 1
+		else:
+			imast._age[p] = 0
+
+		if imast._age[p] >= RC.AGE:
+			mast_pull(imast, p)
+			for c in mast_block(imast, p)[1]:
+				c.deactivate()
+			imast._off.add(p)
+			aged.append(p)
+	return aged
+
+
+###############################################################
+#Master Revive
+
+# mast_revive(imast)
+
+#Input- Imast. The concrete version of the master problem, solved.
+
+#Output- Scenarios brought back in this call.
+#
+# The lower bound check for blocks set aside by mast_age. Each of
+# their scenarios is dispatched on the master's design (see
+# ruizDisp). If one costs more than eta, the master solution is not
+# valid for it, so its block is put back and the master has to be
+# solved again. The master's own dispatch can never cost more than
+# the LP, so no needed block is missed.
+###############################################################
+
+def mast_revive(imast):
+
+	off = getattr(imast, '_off', None)
+	if not off:
+		return []
+
+	eta = value(imast.eta)
+	x = dict((l, int(round(value(imast.x[l])))) for l in imast.L)
+	revived = []
+	for p in sorted(off):
+		dem, genpos = imast._scen[p]
+		disp = RDI.disp_solve(imast, dem, genpos, x, imast.x_star)
+		if disp is not None and (value(disp.Obj)
+								 <= eta + RC.EPSILON * (1 + abs(eta))):
+			continue
+		for c in mast_block(imast, p)[1]:
+			c.activate()
+		mast_push(imast, p)
+		off.discard(p)
+		imast._age[p] = 0
+		revived.append(p)
+	return revived
+
+
+###############################################################
+#Master Start
+
+# mast_start(imast, design)
+
+#Input- Imast. The concrete version of the master problem.
+#		Design. Lines built on each route to start from. Defaults to
+#			the design of the last master solve, the incumbent.
+#			Any other design, such as one from the user, can be
+#			given here.
+
+#Output- Values of the variables of "imast" for a MIP start.
+#		 False if no start could be made.
+#
+# The design fixes x and route_on. Each scenario gets its least cost
+# dispatch on the design (see ruizDisp), and eta is the largest of
+# their costs. For the incumbent, the blocks that were in the last
+# solve keep their values, so only the blocks added since the last
+# start need an LP.
+# Blocks set aside by mast_age are not in the master and are skipped,
+# but eta still meets the Benders cuts (see mast_cut).
+###############################################################
+
+def mast_start(imast, design=None):
+
+	scen = getattr(imast, '_scen', None) or {}
+	incumbent = design is None
+	if incumbent:
+		design = imast.x
+	x = dict((l, value(design[l], exception=False)) for l in imast.L)
+	if any(v is None for v in x.values()):
+		return False
+
+	#The design has to fit the first stage rows
+	x = dict((l, int(round(v))) for l, v in x.items())
+	if (any(x[l] < value(imast.x_star[l]) or x[l] > value(imast.maxLines)
+			for l in imast.L)
+		or sum(value(imast.c[l]) * x[l] for l in imast.L)
+			> value(imast.pi) + RC.EPSILON):
+		return False
+
+	for l in imast.L:
+		imast.x[l].set_value(x[l])
+		imast.route_on[l].set_value(int(x[l] > 0))
+
+	#Dispatch of each scenario, and its cost
+	fresh = getattr(imast, '_fresh', set())
+	off = getattr(imast, '_off', None) or set()
+	eta = 0
+	for p in imast.P:
+		if p in off:
+			continue
+		if not incumbent or p in fresh:
+			if p not in scen:
+				return False
+			disp = RDI.disp_solve(imast, scen[p][0], scen[p][1], x,
+				imast.x_star)
+			if disp is None:
+				return False
+			vals = RDI.disp_values(disp)
+			for name in RDI.DISPVARS:
+				var = getattr(imast, name)
+				for i, val in vals[name].items():
+					var[p,i].set_value(val, skip_validation=True)
+		eta = max(eta, mast_cost(imast, p))
+	for const, coef in getattr(imast, '_cuts', None) or []:
+		eta = max(eta, const + sum(coef[l] * x[l] for l in coef))
+	imast.eta.set_value(eta)
+	imast._fresh = set()
+	return True
+
+
+###############################################################
+#Master Pool
+
+# mast_pool(imast, k)
+
+#Input- Imast. The concrete version of the master problem, solved.
+#		K. Most designs wanted.
+
+#Output- Up to k designs of the solver's solution pool other than
+#		 the one loaded in "imast", best first. Each is a list of
+#		 (source, dest, lines built), as START_X_STAR.
+#
+# The pool is read from the persistent CPLEX holding the master, so
+# there are no designs without it, and ruizMain will not start with
+# RC.POOLK > 1 unless RC.PERSISTENT and RC.PSOLVER set one up. A
+# solve only keeps the incumbents it passed through, often of one
+# design, so the pool is first filled by CPLEX's populate from the
+# tree of the last solve.
+###############################################################
+
+def mast_pool(imast, k):
+
+	popt = getattr(imast, '_popt', None)
+	if popt is None or k < 1 or not hasattr(popt, '_solver_model'):
+		return []
+
+	#Most pool solutions differ only in the dispatch, so populate
+	#searches hard and for several times the designs wanted
+	cpx = popt._solver_model
+	intensity = cpx.parameters.mip.pool.intensity.get()
+	cpx.parameters.mip.pool.intensity.set(4)
+	cpx.parameters.mip.limits.populate.set(cpx.solution.pool.get_num() + 10*k)
+	cpx.populate_solution_pool()
+	cpx.parameters.mip.pool.intensity.set(intensity)
+	names = [popt._pyomo_var_to_solver_var_map[imast.x[l]] for l in imast.L]
+	seen = set([tuple(int(round(value(imast.x[l]))) for l in imast.L)])
+	found = []
+	for n in range(cpx.solution.pool.get_num()):
+		x = tuple(int(round(v)) for v in cpx.solution.pool.get_values(n, names))
+		if x in seen:
+			continue
+		seen.add(x)
+		found.append((cpx.solution.pool.get_objective_value(n), x))
+
+	found.sort()
+	return [[(i, j, n) for (i, j), n in zip(imast.L, x)]
+			for obj, x in found[:k]]
+
+
+###############################################################
+#Master Solve
+
+# mast_solve(imast, warmstart, gap)
+
+#Input- Imast. The concrete version of the master problem.
+#		Warmstart. Pass the values in "imast" as a MIP start.
+#			See mast_start.
+#		Gap. Relative MIP gap of the solve. Defaults to RC.MIPGAP.
+#		Timelimit. Seconds the solve may take, or None for no limit.
+
+#Output- Results of the solve. The solution is loaded into "imast".
+#		 A solve stopped by its time limit before it found a design
+#		 has none, its status is "error", and "imast" is left as it
+#		 was.
+#
+# With RC.PERSISTENT the whole master is only written to the solver
+# on its first solve. Later blocks are added by mast_push, and the
+# solver keeps its model and search information between solves.
+###############################################################
+
+def mast_solve(imast, warmstart=False, gap=None, timelimit=None):
+
+	if gap is None:
+		gap = RC.MIPGAP
+	load = timelimit is None
+	if not RC.PERSISTENT:
+		options = {'mipgap': gap}
+		if timelimit is not None:
+			options['timelimit'] = timelimit
+		results = opt.solve(imast, warmstart=warmstart, load_solutions=load,
+							options=options)
+	else:
+		#Each master instance gets its own persistent solver
+		if getattr(imast, '_popt', None) is None:
+			imast._popt = SolverFactory(RC.PSOLVER)
+			imast._popt.set_instance(imast)
+		cpx = imast._popt._solver_model
+		imast._popt.options['mipgap'] = gap
+		imast._popt.options['timelimit'] = (cpx.parameters.timelimit.default()
+			if timelimit is None else timelimit)
+
+		#Only the newest start, older ones are for older masters
+		if warmstart:
+			cpx.MIP_starts.delete()
+		results = imast._popt.solve(imast, warmstart=warmstart,
+									load_solutions=load)
+
+	if not load and results.solver.status != SolverStatus.error:
+		imast.solutions.load_from(results)
+	return results
+
+
+###############################################################
+#Master Bound
+
+# mast_bound(imast, results)
+
+#Input- Imast. The concrete version of the master problem, solved.
+#		Results. Results of mast_solve.
+
+#Output- Lower bound of the master. The solver's best bound, or the
+#		 objective if it gave none.
+#
+# With a MIP gap the design found is only within the gap of the best
+# one, so its objective is not a lower bound on its own.
+###############################################################
+
+def mast_bound(imast, results):
+
+	bound = results.problem.lower_bound
+	if bound is None or not math.isfinite(bound):
+		return value(imast.Obj)
+	return min(bound, value(imast.Obj))
 	
 
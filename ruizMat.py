@@ -0,0 +1,316 @@
+#######################################################################
+#SubProblem Matrix Builder
+
+#Builds the same single level KKT problem as ruizSub, but directly as
+#sparse matrices from the network data, without any Pyomo expressions.
+#For a fixed x_star the subproblem is a MILP whose rows come straight
+#from the node-line incidence matrix and the node and line data, so
+#it can be assembled with a handful of vectorized operations and
+#handed to the matrix interface of a MILP solver.
+
+#Input–	(From main) Data. Loaded data from ruizData.data_load.
+#		(From main) X. Lines built on each route.
+
+#Output- (To main) Objective, demand and generation possible of the
+#				   worst case, the same values read from ruizSub.
+
+#Requires numpy and scipy (scipy.optimize.milp, which uses HiGHS).
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import value
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import milp, LinearConstraint, Bounds
+import ruizC as RC
+import ruizNet as RN
+import math
+
+
+###############################################################
+#Matrix Build
+
+# mat_build(data, x)
+
+#Input-	Data. Loaded data of the problem.
+#		X. Lines built on each route, indexed by line.
+
+#Output- Dictionary of the problem in the form
+#			min c*v  s.t.  bl <= A*v <= bu,  lb <= v <= ub
+#		 with
+#			A, bl, bu 	- Sparse rows and their bounds
+#			c, const 	- Costs and constant of the objective
+#			lb, ub 		- Variable bounds
+#			integrality - 1 for binary variables, 0 otherwise
+#			cols 		- Variable name --> {index: column}
+#
+# The rows and variables are the same as in ruizSub.mod, except that
+# simple bounds such as demmin <= dem <= demmax are given as variable
+# bounds. The objective is negated, since ruizSub maximizes.
+###############################################################
+
+def mat_build(data, x):
+
+	N = data['N']
+	L = data['L']
+	net = RN.net_index(N, L)
+	nN = len(N)
+	nL = len(L)
+	sigma = data['sigma']
+	ref = data['ref']
+
+	#Entries covered by "param ... default" in the data file are not
+	#in the data itself, create_instance fills them from the default
+	defaults = getattr(data, '_default', {})
+	def par(name, key):
+		return data[name].get(key, defaults.get(name, 0))
+
+	#Nodes that generate and nodes with demand, as in ruizNet
+	G = [i for i in N if par('supmax', i) > 0]
+	D = [i for i in N if par('demmax', i) > 0]
+	nG = len(G)
+	nD = len(D)
+
+	#Node and line data as vectors, ordered as in the network index
+	def nvec(name, nodes):
+		return np.array([par(name, i) for i in nodes], dtype=float)
+	def lvec(name):
+		return np.array([par(name, l) for l in L], dtype=float)
+
+	xs = np.array([int(round(value(x[l]))) for l in L], dtype=float)
+
+	#With RC.DROPLINES only built lines are part of the problem
+	if RC.DROPLINES:
+		keep = np.flatnonzero(xs)
+	else:
+		keep = np.arange(nL)
+	LK = [L[n] for n in keep]
+	nK = len(LK)
+	xk = xs[keep]
+	cap = lvec('cap')[keep] * xk
+	bx = lvec('b')[keep] * xk
+	gencost = nvec('gencost', G)
+	shed = nvec('shed', D)
+	supmax = nvec('supmax', G)
+	supmin = nvec('supmin', G)
+	demmax = nvec('demmax', D)
+	demmin = nvec('demmin', D)
+
+	#Places the G and D nodes among all the nodes
+	gpos = np.array([net['nodepos'][i] for i in G], dtype=int)
+	dpos = np.array([net['nodepos'][i] for i in D], dtype=int)
+	EG = sp.csr_matrix((np.ones(nG), (gpos, np.arange(nG))), shape=(nN, nG))
+	ED = sp.csr_matrix((np.ones(nD), (dpos, np.arange(nD))), shape=(nN, nD))
+
+	#Sparse node-line incidence, +1 into a node and -1 out of it
+	inc = sp.coo_matrix(
+		([v for v in net['incid'].values()],
+		([net['nodepos'][i] for (i,l) in net['incid']],
+		 [net['linepos'][l] for (i,l) in net['incid']])),
+		shape=(nN, nL)).tocsr()[:, keep]
+
+	###############################
+	#Columns
+	###############################
+	cols = {}
+	lb = []
+	ub = []
+	integ = []
+
+	def add(name, keys, lo, hi, binary=0):
+		start = len(lb)
+		cols[name] = dict((key, start + n) for n, key in enumerate(keys))
+		lb.extend(np.broadcast_to(lo, (len(keys),)))
+		ub.extend(np.broadcast_to(hi, (len(keys),)))
+		integ.extend([binary] * len(keys))
+		return np.arange(start, start + len(keys))
+
+	inf = np.inf
+	pi = math.pi
+	thetalo = np.full(nN, -pi)
+	thetahi = np.full(nN, pi)
+	thetalo[net['nodepos'][ref]] = 0
+	thetahi[net['nodepos'][ref]] = 0
+
+	#Primal variables (Capacity, Demand, GenPos and Reference as bounds)
+	tran = add('tran', LK, -cap, cap)
+	dem = add('dem', D, np.maximum(demmin, 0), demmax)
+	genpos = add('genpos', G, np.maximum(supmin, 0), supmax)
+	gen = add('gen', G, 0, inf)
+	unmet = add('unmet', D, 0, inf)
+	theta = add('theta', N, thetalo, thetahi)
+
+	#Dual variables
+	genmax_d = add('genmax_dual', G, 0, inf)
+	genmin_d = add('genmin_dual', G, 0, inf)
+	unmetmax_d = add('unmetmax_dual', D, 0, inf)
+	unmetmin_d = add('unmetmin_dual', D, 0, inf)
+	thetamax_d = add('thetamax_dual', N, 0, inf)
+	thetamin_d = add('thetamin_dual', N, 0, inf)
+	capmax_d = add('capmax_dual', LK, 0, inf)
+	capmin_d = add('capmin_dual', LK, 0, inf)
+	theta_d = add('theta_dual', LK, -inf, inf)
+	flow_d = add('flow_dual', N, -inf, inf)
+	ref_d = add('ref_dual', [None], -inf, inf)
+
+	#Binary variables
+	z_genmax = add('z_genmax', G, 0, 1, 1)
+	z_genmin = add('z_genmin', G, 0, 1, 1)
+	z_unmetmax = add('z_unmetmax', D, 0, 1, 1)
+	z_unmetmin = add('z_unmetmin', D, 0, 1, 1)
+	z_thetamax = add('z_thetamax', N, 0, 1, 1)
+	z_thetamin = add('z_thetamin', N, 0, 1, 1)
+	z_capmax = add('z_capmax', LK, 0, 1, 1)
+	z_capmin = add('z_capmin', LK, 0, 1, 1)
+	nv = len(lb)
+
+	###############################
+	#Rows
+	###############################
+	blocks = []
+	bl = []
+	bu = []
+
+	#Rows of the form sum(coef_j * column_j) in [lo, hi], one row per
+	#entry of the column arrays
+	def rows(terms, lo, hi):
+		m = len(terms[0][1])
+		mat = sp.csr_matrix((m, nv))
+		for coef, col in terms:
+			coef = np.broadcast_to(coef, (m,))
+			mat = mat + sp.csr_matrix((coef, (np.arange(m), col)),
+				shape=(m, nv))
+		blocks.append(mat)
+		bl.extend(np.broadcast_to(lo, (m,)))
+		bu.extend(np.broadcast_to(hi, (m,)))
+
+	#Rows built from a sparse block over some of the columns
+	def rows_mat(parts, lo, hi):
+		m = parts[0][0].shape[0]
+		mat = sp.csr_matrix((m, nv))
+		for block, col in parts:
+			block = sp.coo_matrix(block)
+			mat = mat + sp.csr_matrix((block.data, (block.row,
+				col[block.col])), shape=(m, nv))
+		blocks.append(mat)
+		bl.extend(np.broadcast_to(lo, (m,)))
+		bu.extend(np.broadcast_to(hi, (m,)))
+
+	eye = sp.identity
+
+	#Generation <= Generation Possible
+	rows([(1, gen), (-1, genpos)], -inf, 0)
+
+	#Unmet Demand <= Demand
+	rows([(1, unmet), (-1, dem)], -inf, 0)
+
+	#Flow + Supply - Demand = (-Unmet)
+	rows_mat([(inc, tran), (EG, gen), (-ED, dem), (ED, unmet)], 0, 0)
+
+	#(b)*(theta_i - theta_j)*x = flow
+	rows_mat([(sp.diags(bx) @ -inc.T, theta), (-eye(nK), tran)], 0, 0)
+
+	#Uncertainty Budgets
+	supden = sum(par('supmax', i) - par('supmin', i) for i in N)
+	if supden > RC.UNCTOL * nN:
+		rhs = np.sum(supmax) - data['uncS'] * supden
+		rows_mat([(np.ones((1, nG)), genpos)], rhs, rhs)
+	demden = sum(par('demmax', i) - par('demmin', i) for i in N)
+	if demden > RC.UNCTOL * nN:
+		rhs = data['uncD'] * demden + np.sum(demmin)
+		rows_mat([(np.ones((1, nD)), dem)], rhs, rhs)
+
+	#Linearized Complementarity Constraints
+	#Big Ms of each constraint as in ruizBigM
+	M = data['M']
+	if RC.TIGHTM:
+		Mgen = supmax
+		Mdem = demmax
+		Mcap = 2 * lvec('cap')[keep] * data['maxLines']
+		Mtheta = 2 * pi
+	else:
+		Mgen = data['Mgen']
+		Mdem = data['Mdem']
+		Mcap = data['Mcap']
+		Mtheta = data['Mtheta']
+	rows([(1, genpos), (-1, gen), (-Mgen, z_genmax)], -inf, 0)
+	rows([(1, genmax_d), (M, z_genmax)], -inf, M)
+	rows([(1, gen), (-Mgen, z_genmin)], -inf, 0)
+	rows([(1, genmin_d), (M, z_genmin)], -inf, M)
+	rows([(1, dem), (-1, unmet), (-Mdem, z_unmetmax)], -inf, 0)
+	rows([(1, unmetmax_d), (M, z_unmetmax)], -inf, M)
+	rows([(1, unmet), (-Mdem, z_unmetmin)], -inf, 0)
+	rows([(1, unmetmin_d), (M, z_unmetmin)], -inf, M)
+	rows([(-1, tran), (-Mcap, z_capmax)], -inf, -cap)
+	rows([(1, capmax_d), (M, z_capmax)], -inf, M)
+	rows([(1, tran), (-Mcap, z_capmin)], -inf, -cap)
+	rows([(1, capmin_d), (M, z_capmin)], -inf, M)
+	rows([(-1, theta), (-Mtheta, z_thetamax)], -inf, -pi)
+	rows([(1, thetamax_d), (M, z_thetamax)], -inf, M)
+	rows([(1, theta), (-Mtheta, z_thetamin)], -inf, -pi)
+	rows([(1, thetamin_d), (M, z_thetamin)], -inf, M)
+
+	#Lagrangian with respect to Generation and Unmet Demand
+	rows([(-1, flow_d[gpos]), (1, genmax_d), (-1, genmin_d)],
+		-sigma * gencost, -sigma * gencost)
+	rows([(-1, flow_d[dpos]), (1, unmetmax_d), (-1, unmetmin_d)],
+		-sigma * shed, -sigma * shed)
+
+	#Lagrangian with respect to Transmission, for built lines only
+	built = np.flatnonzero(xk)
+	if len(built):
+		xb = sp.diags(xk).tocsr()[built]
+		rows_mat([(xb @ -inc.T, flow_d), (-xb, theta_d), (xb, capmax_d),
+			(-xb, capmin_d)], 0, 0)
+
+	#Lagrangian with respect to Theta
+	refrow = np.zeros((nN, 1))
+	refrow[net['nodepos'][ref], 0] = -1
+	rows_mat([(-inc @ sp.diags(bx), theta_d), (eye(nN), thetamax_d),
+		(-eye(nN), thetamin_d), (refrow, ref_d)], 0, 0)
+
+	#Objective (negated)
+	c = np.zeros(nv)
+	c[gen] = -sigma * gencost
+	c[unmet] = -sigma * shed
+	const = float(np.dot(lvec('c'), xs))
+
+	return {'A': sp.vstack(blocks).tocsr(), 'bl': np.array(bl),
+			'bu': np.array(bu), 'c': c, 'const': const,
+			'lb': np.array(lb), 'ub': np.array(ub),
+			'integrality': np.array(integ), 'cols': cols}
+
+
+###############################################################
+#Matrix Solve
+
+# mat_solve(mat)
+
+#Input-	Mat. A problem from mat_build.
+
+#Output- Dictionary with
+#			Obj 	- Value of the maximization, as in ruizSub
+#			dem 	- Worst case demand at each node
+#			genpos 	- Worst case generation possible at each node
+#			values 	- Variable name --> {index: value}
+#			status	- Status message of the solver
+###############################################################
+
+def mat_solve(mat):
+
+	res = milp(mat['c'],
+		constraints=LinearConstraint(mat['A'], mat['bl'], mat['bu']),
+		integrality=mat['integrality'],
+		bounds=Bounds(mat['lb'], mat['ub']),
+		options={'mip_rel_gap': RC.MIPGAP})
+
+	out = {'status': res.message, 'Obj': None, 'values': {}}
+	if res.x is None:
+		return out
+
+	out['Obj'] = mat['const'] - res.fun
+	for name, idx in mat['cols'].items():
+		out['values'][name] = dict((key, res.x[n]) for key, n in idx.items())
+	out['dem'] = out['values']['dem']
+	out['genpos'] = out['values']['genpos']
+	return out
@@ -0,0 +1,106 @@
+#######################################################################
+#Network Index
+
+#Builds the node-line incidence of a network one time, so that the
+#flow balance and Lagrangian rules of both the master and subproblem
+#can look up the lines at a node directly instead of scanning the
+#whole line set for every node.
+
+#Input–	(From models) The node set N and line set L of a concrete model.
+
+#Output- (To models) A dictionary with
+#			in		- Node --> lines that end at the node
+#			out		- Node --> lines that start at the node
+#			ends	- Line --> (source, dest)
+#			incid	- Sparse incidence {(node, line): +1 or -1}
+#					  +1 if the line ends at the node, -1 if it starts
+#			nodepos - Node --> row of node in the incidence matrix
+#			linepos - Line --> column of line in the incidence matrix
+#		 And the rules for the node subsets that generate or have load.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import value
+
+_NETS = {}		#Built network indices, keyed by (nodes, lines)
+
+
+###############################################################
+#Net Index
+
+# net_index(N, L)
+
+#Input-	N. Nodes of the network.
+#		L. Lines of the network as (source, dest) pairs.
+
+#Output- The network index dictionary described above.
+#
+# Built in a single pass over the lines, so the cost is O(N + L).
+# Networks with the same nodes and lines share one index.
+###############################################################
+
+def net_index(N, L):
+
+	nodes = tuple(N)
+	lines = tuple(L)
+	key = (nodes, lines)
+	if key in _NETS:
+		return _NETS[key]
+
+	net = {	'in': 		dict((i, []) for i in nodes),
+			'out': 		dict((i, []) for i in nodes),
+			'ends': 	{},
+			'incid': 	{},
+			'nodepos': 	dict((i, n) for n, i in enumerate(nodes)),
+			'linepos':	dict((l, n) for n, l in enumerate(lines))}
+
+	for (i,j) in lines:
+		net['out'][i].append((i,j))
+		net['in'][j].append((i,j))
+		net['ends'][i,j] = (i,j)
+		net['incid'][i,(i,j)] = -1
+		net['incid'][j,(i,j)] = 1
+
+	_NETS[key] = net
+	return net
+
+
+###############################################################
+#Net Of
+
+# net_of(inst)
+
+#Input-	Inst. A concrete master or subproblem instance.
+
+#Output- The network index of the instance.
+#
+# The index is stored on the instance the first time a rule asks
+# for it, so every later rule reuses it.
+###############################################################
+
+def net_of(inst):
+
+	if not hasattr(inst, '_net'):
+		inst._net = net_index(inst.N, inst.L)
+	return inst._net
+
+
+###############################################################
+#Generation and Demand Nodes
+
+# gen_nodes(mod), dem_nodes(mod)
+
+#Input-	Mod. A master or subproblem model under construction.
+
+#Output- Nodes that can generate (supmax > 0) or that have load
+#		 (demmax > 0). Used to initialize the sets G and D.
+#
+# Generation, shedding and their duals and binaries are zero at every
+# other node, so the models only index them over these subsets.
+###############################################################
+
+def gen_nodes(mod):
+	return [i for i in mod.N if value(mod.supmax[i]) > 0]
+
+def dem_nodes(mod):
+	return [i for i in mod.N if value(mod.demmax[i]) > 0]
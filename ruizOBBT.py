@@ -0,0 +1,253 @@
+#######################################################################
+#Bound Tightening of the Subproblem
+
+#Tightens the per-constraint big Ms of the subproblem (see ruizBigM)
+#for one design by optimization based bound tightening. For each
+#big M row, the left hand side (a dual such as genmax_dual, or a
+#primal slack such as pi - theta or cap*x - tran) is maximized over
+#the LP relaxation of the subproblem. Every point of the MILP is in
+#the relaxation, so the maximum is a valid M for that row.
+
+#The LPs are split between the processes of a pool, which main keeps
+#for the whole run. Each process parses the data once and keeps one
+#relaxed instance in a persistent solver for it. A new design only
+#changes x_star and the rows that depend on it, and the objective
+#changes between LPs.
+
+#Results are cached by data file and design, so later solves of the
+#same design reuse them.
+
+#Input–	(From main) Path of the data file, the design x_star and the
+#		pool of processes.
+
+#Output- (To main) New Ms, applied to the subproblem by obbt_apply.
+#######################################################################
+
+# -*- coding: utf-8 -*-
+from pyomo.environ import *
+from pyomo.opt import SolverFactory, TerminationCondition
+from pyomo.core.expr.visitor import (identify_mutable_parameters,
+	identify_variables)
+from concurrent.futures import ProcessPoolExecutor
+import ruizC as RC
+import ruizSub as s
+import ruizData as RD
+import ruizBigM as RB
+import math
+import os
+
+_BOUNDS = {}		#Tightened Ms, keyed by (path, modified time, design)
+_RELAXED = {}		#Relaxed subproblem of this process, keyed by path
+
+#Big M --> left hand side of its row, which is maximized for the M
+TARGETS = {
+	'Mgenmax':			lambda m, i: m.genpos[i] - m.gen[i],
+	'Mgenmin':			lambda m, i: m.gen[i],
+	'Munmetmax':		lambda m, i: m.dem[i] - m.unmet[i],
+	'Munmetmin':		lambda m, i: m.unmet[i],
+	'Mcapmax':			lambda m, l: m.cap[l] * m.x_star[l] - m.tran[l],
+	'Mcapmin':			lambda m, l: m.cap[l] * m.x_star[l] + m.tran[l],
+	'Mthetamax':		lambda m, i: math.pi - m.theta[i],
+	'Mthetamin':		lambda m, i: m.theta[i] + math.pi,
+	'Mgenmax_dual':		lambda m, i: m.genmax_dual[i],
+	'Mgenmin_dual':		lambda m, i: m.genmin_dual[i],
+	'Munmetmax_dual':	lambda m, i: m.unmetmax_dual[i],
+	'Munmetmin_dual':	lambda m, i: m.unmetmin_dual[i],
+	'Mcapmax_dual':		lambda m, l: m.capmax_dual[l],
+	'Mcapmin_dual':		lambda m, l: m.capmin_dual[l],
+	'Mthetamax_dual':	lambda m, i: m.thetamax_dual[i],
+	'Mthetamin_dual':	lambda m, i: m.thetamin_dual[i]}
+
+#Relative and absolute safety added to each bound
+OBBTTOL = 1e-6
+
+
+###############################################################
+#OBBT
+
+# obbt(path, x, pool, isub)
+
+#Input-	Path. The data file.
+#		X. Lines built on each route.
+#		Pool. A concurrent.futures executor of processes, or None
+#			for one made for this call.
+#		Isub. A subproblem instance of the data, for the index sets
+#			of the Ms. Defaults to the relaxed one this process keeps
+#			(see obbt_model).
+
+#Output- Dictionary of M name --> {index: tightened M}
+#
+# The LPs are shared between RC.WORKERS processes, or solved in this
+# process if RC.WORKERS is 1.
+###############################################################
+
+def obbt(path, x, pool=None, isub=None):
+
+	path = os.path.abspath(path)
+	design = tuple(sorted((l, int(round(value(x[l])))) for l in x))
+	key = (path, os.path.getmtime(path), design)
+	if key in _BOUNDS:
+		return _BOUNDS[key]
+
+	#Targets of the lines that are built, or all lines
+	if isub is None:
+		isub = obbt_model(path, design)[0]
+	built = dict(design)
+	jobs = []
+	for name in TARGETS:
+		for i in getattr(isub, name):
+			if (name.startswith('Mcap') and RC.DROPLINES
+				and built.get(i, 0) == 0):
+				continue
+			jobs.append((name, i))
+
+	#Split the targets between the workers
+	nchunk = max(1, min(RC.WORKERS, len(jobs)))
+	chunks = [jobs[n::nchunk] for n in range(nchunk)]
+	bounds = dict((name, {}) for name in TARGETS)
+	if nchunk == 1:
+		results = [obbt_chunk(path, design, chunks[0])]
+	elif pool is not None:
+		results = list(pool.map(obbt_chunk, [path] * nchunk,
+			[design] * nchunk, chunks))
+	else:
+		with ProcessPoolExecutor(max_workers=nchunk) as own:
+			results = list(own.map(obbt_chunk, [path] * nchunk,
+				[design] * nchunk, chunks))
+	for result in results:
+		for name, i, m in result:
+			bounds[name][i] = m
+
+	_BOUNDS[key] = bounds
+	return bounds
+
+
+###############################################################
+#OBBT Model
+
+# obbt_model(path, design)
+
+#Input-	Path. The data file.
+#		Design. Tuple of (line, lines built).
+
+#Output- (isub, lopt), the relaxed subproblem of this process at
+#		 "design", and its persistent solver, or None for the solver
+#		 if the instance is not loaded in it yet.
+#
+# Built once per process and data file. For each new design
+# sub_func sets x_star and fixes the lines that are not built. Only
+# the rows that hold x_star or a variable of a line are taken out of
+# the solver and put back, if active: the solver writes a fixed
+# variable into a row as a constant, so a row has to be written again
+# when its line is built or dropped.
+###############################################################
+
+def obbt_model(path, design):
+
+	data = RD.data_load(path)
+	if path not in _RELAXED or _RELAXED[path]['data'] is not data:
+		isub = s.mod.create_instance(data)
+		TransformationFactory('core.relax_integer_vars').apply_to(isub)
+		isub.Obj.deactivate()
+
+		#Rows that hold x_star, in the body or the bounds, or a
+		#variable of a line
+		linevars = [getattr(isub, name) for name in s.LINEVARS
+					if hasattr(isub, name)]
+		rows = []
+		for con in isub.component_data_objects(Constraint):
+			if any(v.parent_component() in linevars
+				   for v in identify_variables(con.body)):
+				rows.append(con)
+				continue
+			for expr in (con.body, con.lower, con.upper):
+				if any(p.parent_component() is isub.x_star
+					   for p in identify_mutable_parameters(expr)):
+					rows.append(con)
+					break
+		_RELAXED[path] = {'data': data, 'isub': isub, 'lopt': None,
+						  'rows': rows, 'loaded': []}
+	model = _RELAXED[path]
+	isub, lopt = model['isub'], model['lopt']
+
+	s.sub_func(isub, dict(design))
+	if lopt is not None:
+		for con in model['loaded']:
+			lopt.remove_constraint(con)
+		for name in s.LINEVARS:
+			if hasattr(isub, name):
+				for var in getattr(isub, name).values():
+					lopt.update_var(var)
+		for con in model['rows']:
+			if con.active:
+				lopt.add_constraint(con)
+	model['loaded'] = [con for con in model['rows'] if con.active]
+	return isub, lopt
+
+
+###############################################################
+#OBBT Chunk
+
+# obbt_chunk(path, design, jobs)
+
+#Input-	Path. The data file.
+#		Design. Tuple of (line, lines built).
+#		Jobs. List of (M name, index) to tighten.
+
+#Output- List of (M name, index, tightened M)
+#
+# Run inside a worker. A bound is only kept if its LP is solved to
+# optimality and it is smaller than the current M.
+###############################################################
+
+def obbt_chunk(path, design, jobs):
+
+	#Relaxed subproblem for this design
+	isub, lopt = obbt_model(path, design)
+
+	out = []
+	for n, (name, i) in enumerate(jobs):
+		isub.del_component('BoundObj')
+		isub.BoundObj = Objective(expr=TARGETS[name](isub, i),
+			sense=maximize)
+		if lopt is None:
+			lopt = SolverFactory(RC.PSOLVER)
+			lopt.set_instance(isub)
+			_RELAXED[path]['lopt'] = lopt
+		else:
+			lopt.set_objective(isub.BoundObj)
+
+		results = lopt.solve(isub)
+		if (results.solver.termination_condition
+			!= TerminationCondition.optimal):
+			continue
+
+		current = value(getattr(isub, name)[i])
+		m = max(0, value(isub.BoundObj))
+		m = m + OBBTTOL * (1 + m)
+		if m < current:
+			out.append((name, i, m))
+	return out
+
+
+###############################################################
+#OBBT Apply
+
+# obbt_apply(isub, bounds)
+
+#Input-	Isub. The concrete version of the subproblem.
+#		Bounds. Tightened Ms from obbt, for the design in "isub".
+
+#Output- Makes changes in the "isub" instance
+#
+# The Ms of an earlier design are reset first, since they are not
+# valid for a new one.
+###############################################################
+
+def obbt_apply(isub, bounds):
+
+	RB.bigm_reset(isub)
+	for name in bounds:
+		param = getattr(isub, name)
+		for i, m in bounds[name].items():
+			param[i] = m
@@ -25,8 +25,14 @@
 
 # -*- coding: utf-8 -*-
 from pyomo.environ import *
-from pyomo.opt import SolverFactory
+from pyomo.opt import SolverFactory, SolverResults, SolverStatus
+from pyomo.opt import TerminationCondition
+from pyomo.repn import generate_standard_repn
 import ruizC as RC
+import ruizNet as RN
+import ruizBigM as RB
+import ruizDisp as RDI
+import ruizMast as m
 import math
 
 mod = AbstractModel()
@@ -71,27 +77,51 @@ mod.Mtran = 	Param()					#Most that can be transmitted
 mod.x_star = 	Param(mod.L, domain=NonNegativeIntegers, default=0,
 	mutable = True) 					#Built Lines
 
+#Derived Sets
+mod.G = 	Set(within=mod.N, initialize=RN.gen_nodes)	#Nodes that generate
+mod.D = 	Set(within=mod.N, initialize=RN.dem_nodes)	#Nodes with demand
+
+#Per-Constraint Big Ms, computed from the data (see ruizBigM)
+#Mutable, so later passes can tighten them without a rebuild
+mod.Mgenmax 	= Param(mod.G, mutable=True, initialize=RB.m_gen)
+mod.Mgenmin 	= Param(mod.G, mutable=True, initialize=RB.m_gen)
+mod.Munmetmax 	= Param(mod.D, mutable=True, initialize=RB.m_dem)
+mod.Munmetmin 	= Param(mod.D, mutable=True, initialize=RB.m_dem)
+mod.Mcapmax 	= Param(mod.L, mutable=True, initialize=RB.m_cap)
+mod.Mcapmin 	= Param(mod.L, mutable=True, initialize=RB.m_cap)
+mod.Mthetamax 	= Param(mod.N, mutable=True, initialize=RB.m_theta)
+mod.Mthetamin 	= Param(mod.N, mutable=True, initialize=RB.m_theta)
+mod.Mgenmax_dual 	= Param(mod.G, mutable=True, initialize=RB.m_dual)
+mod.Mgenmin_dual 	= Param(mod.G, mutable=True, initialize=RB.m_dual)
+mod.Munmetmax_dual 	= Param(mod.D, mutable=True, initialize=RB.m_dual)
+mod.Munmetmin_dual 	= Param(mod.D, mutable=True, initialize=RB.m_dual)
+mod.Mcapmax_dual 	= Param(mod.L, mutable=True, initialize=RB.m_dual)
+mod.Mcapmin_dual 	= Param(mod.L, mutable=True, initialize=RB.m_dual)
+mod.Mthetamax_dual 	= Param(mod.N, mutable=True, initialize=RB.m_dual)
+mod.Mthetamin_dual 	= Param(mod.N, mutable=True, initialize=RB.m_dual)
+
 
 ###############################################################
 #Variables
 ###############################################################
 
 #Variables
+#Generation only at nodes in G, demand only at nodes in D
 mod.tran   = Var(mod.L, within=Reals) 			 #Ammount Transmitted
-mod.dem    = Var(mod.N, domain=NonNegativeReals) #Demand
-mod.genpos = Var(mod.N, domain=NonNegativeReals) #Max Possible Gen
-mod.gen    = Var(mod.N, domain=NonNegativeReals) #Generation
-mod.unmet  = Var(mod.N, domain=NonNegativeReals) #Unfilled Demand
+mod.dem    = Var(mod.D, domain=NonNegativeReals) #Demand
+mod.genpos = Var(mod.G, domain=NonNegativeReals) #Max Possible Gen
+mod.gen    = Var(mod.G, domain=NonNegativeReals) #Generation
+mod.unmet  = Var(mod.D, domain=NonNegativeReals) #Unfilled Demand
 
 #Angle in [-pi,pi]
 mod.theta = Var(mod.N,bounds=(-math.pi, math.pi))
 
 #Dual Variables
 #Positive for Inequalities
-mod.genmax_dual	  =	Var(mod.N, domain=NonNegativeReals) #[Phi^(E.max)]
-mod.genmin_dual	  =	Var(mod.N, domain=NonNegativeReals) #[Phi^(E.min)]
-mod.unmetmax_dual = Var(mod.N, domain=NonNegativeReals) #[Phi^(D.max)]
-mod.unmetmin_dual = Var(mod.N, domain=NonNegativeReals) #[Phi^(D.min)]
+mod.genmax_dual	  =	Var(mod.G, domain=NonNegativeReals) #[Phi^(E.max)]
+mod.genmin_dual	  =	Var(mod.G, domain=NonNegativeReals) #[Phi^(E.min)]
+mod.unmetmax_dual = Var(mod.D, domain=NonNegativeReals) #[Phi^(D.max)]
+mod.unmetmin_dual = Var(mod.D, domain=NonNegativeReals) #[Phi^(D.min)]
 mod.thetamax_dual = Var(mod.N, domain=NonNegativeReals) #[Phi^(N.max)]
 mod.thetamin_dual = Var(mod.N, domain=NonNegativeReals) #[Phi^(N.min)]
 mod.capmax_dual   =	Var(mod.L, domain=NonNegativeReals) #[Phi^(L.max)]
@@ -103,10 +133,10 @@ mod.ref_dual	  = Var()								#[Chi^Ref]
 	#Dual for reference variable -->  theta[mod.ref] = 0
 
 #Binary Variables for Complementary Condition Linearization
-mod.z_genmax	=	Var(mod.N, domain=Binary)	#For Generation Max
-mod.z_genmin	=	Var(mod.N, domain=Binary)	#For Generation Min
-mod.z_unmetmax	=	Var(mod.N, domain=Binary)	#For Unmet Demand Max
-mod.z_unmetmin	=	Var(mod.N, domain=Binary)	#For Unmet Demand Min
+mod.z_genmax	=	Var(mod.G, domain=Binary)	#For Generation Max
+mod.z_genmin	=	Var(mod.G, domain=Binary)	#For Generation Min
+mod.z_unmetmax	=	Var(mod.D, domain=Binary)	#For Unmet Demand Max
+mod.z_unmetmin	=	Var(mod.D, domain=Binary)	#For Unmet Demand Min
 mod.z_thetamax	=	Var(mod.N, domain=Binary)	#For Theta Max 
 mod.z_thetamin	=	Var(mod.N, domain=Binary)	#For Theta Min
 mod.z_capmax	=	Var(mod.L, domain=Binary)	#For Capacity Max
@@ -120,8 +150,8 @@ mod.z_capmin	=	Var(mod.L, domain=Binary)	#For Capacity Min
 #	max sigma * [gen_cost * generation + shed_cost * unfilled_demand]
 #		+ c^t*x
 def obj_expression(mod):
-	return (mod.sigma * (sum(mod.gencost[i] * mod.gen[i] for i in mod.N) 
-		 + sum(mod.shed[i] * mod.unmet[i] for i in mod.N))
+	return (mod.sigma * (sum(mod.gencost[i] * mod.gen[i] for i in mod.G) 
+		 + sum(mod.shed[i] * mod.unmet[i] for i in mod.D))
 		 + sum(mod.c[j] * mod.x_star[j] for j in mod.L))
 mod.Obj = Objective(rule=obj_expression, sense = maximize)
 
@@ -131,7 +161,7 @@ mod.Obj = Objective(rule=obj_expression, sense = maximize)
 #	gen_min <= possible_gen <= gen_max
 def genpos_rule(mod, i):
 	return (mod.supmin[i], mod.genpos[i], mod.supmax[i])
-mod.GenPosConstraint = Constraint(mod.N, rule=genpos_rule)
+mod.GenPosConstraint = Constraint(mod.G, rule=genpos_rule)
 
 	
 #Generation is less than Gen Possible
@@ -139,21 +169,21 @@ mod.GenPosConstraint = Constraint(mod.N, rule=genpos_rule)
 # Generation <= Generation Possible
 def max_gen_rule(mod, i):
 	return (mod.gen[i] <= mod.genpos[i])
-mod.MaxGenConstraint = Constraint(mod.N, rule=max_gen_rule)
+mod.MaxGenConstraint = Constraint(mod.G, rule=max_gen_rule)
 
 
 #Demand Min and Max
 #	demand_min <= (Demand) <= demand_max
 def max_dem_rule(mod, i):
 	return (mod.demmin[i], mod.dem[i], mod.demmax[i])
-mod.MaxDemConstraint = Constraint(mod.N, rule=max_dem_rule)
+mod.MaxDemConstraint = Constraint(mod.D, rule=max_dem_rule)
 
 
 #Unmet Demand is less than Demand
 #	("Unmet Demand") <= demand
 def unmet_rule(mod,i):
 	return mod.unmet[i] <= mod.dem[i]
-mod.UnmetConstraint = Constraint(mod.N, rule=unmet_rule)
+mod.UnmetConstraint = Constraint(mod.D, rule=unmet_rule)
 
 
 #Transmisson Capacity
@@ -169,9 +199,13 @@ mod.CapConstraint = Constraint(mod.L, rule=cap_rule)
 #	Flow + Supply - Demand = (-Unmet)
 #flow is positive if from Node 1 to 2, and negative if Node 2 to 1
 def flow_rule(mod, i):
-	flowcol = sum(mod.tran[j,j2] for (j,j2) in mod.L if (j2 == i))
-	flowrow = sum(mod.tran[j,j2] for (j,j2) in mod.L if (j == i))
-	return flowcol - flowrow + mod.gen[i] - mod.dem[i] == -mod.unmet[i]
+	net = RN.net_of(mod)
+	flowcol = sum(mod.tran[l] for l in net['in'][i])
+	flowrow = sum(mod.tran[l] for l in net['out'][i])
+	gen = mod.gen[i] if i in mod.G else 0
+	dem = mod.dem[i] if i in mod.D else 0
+	unmet = mod.unmet[i] if i in mod.D else 0
+	return flowcol - flowrow + gen - dem == -unmet
 mod.FlowConstraint = Constraint(mod.N, rule=flow_rule)
 
 
@@ -203,7 +237,7 @@ def unc_sup_rule(mod):
 		<= (RC.UNCTOL * len(mod.N))):
 		return Constraint.Feasible
 	else:
-		return  (sum(mod.supmax[i] - mod.genpos[i] for i in mod.N)
+		return  (sum(mod.supmax[i] - mod.genpos[i] for i in mod.G)
 			/ sum(mod.supmax[i] - mod.supmin[i] for i in mod.N)
 			== mod.uncS)
 mod.UncSupConstraint = Constraint(rule=unc_sup_rule)
@@ -216,86 +250,197 @@ def unc_dem_rule(mod):
 		<= (RC.UNCTOL * len(mod.N))):
 		return Constraint.Feasible
 	else:
-		return  (sum(mod.dem[i] - mod.demmin[i] for i in mod.N)
+		return  (sum(mod.dem[i] - mod.demmin[i] for i in mod.D)
 			/ sum(mod.demmax[i] - mod.demmin[i] for i in mod.N)
 			== mod.uncD)
 mod.UncDemConstraint = Constraint(rule=unc_dem_rule)
 
+#############################################
+#Complementarity Formulations
+#############################################
+
+#Each complementarity pair is written in the formulation RC.COMP
+#	"bigm" 		- Big M rows on the z binaries
+#	"sos1" 		- SOS1 set on (slack, dual), no big M and no binaries
+#	"indicator" - Two indicator constraints on the z binaries, given
+#				  to the solver by sub_solve (see below)
+#Rows of the other formulations are skipped when an instance is built
+def comp_only(comp, rule, skip=Constraint.Skip):
+	def comp_rule(mod, *i):
+		if RC.COMP != comp:
+			return skip
+		return rule(mod, *i)
+	return comp_rule
+
+def bigm_only(rule):
+	return comp_only("bigm", rule)
+
+def sos1_only(rule):
+	return comp_only("sos1", rule)
+
+def sos1_set(rule):
+	return comp_only("sos1", rule, SOSConstraint.Skip)
+
 #############################################
 #Linearized Complementarity Constraints
 #############################################
 
 #Generation Max Dual	[Phi^(E.max)]
 def gen_rule_max_dual1(mod,i):
-	return  mod.genpos[i] - mod.gen[i] <= (mod.Mgen * mod.z_genmax[i]) 
-mod.GenMaxConstraintDual1 = Constraint(mod.N, rule=gen_rule_max_dual1)
+	return  mod.genpos[i] - mod.gen[i] <= (mod.Mgenmax[i] * mod.z_genmax[i]) 
+mod.GenMaxConstraintDual1 = Constraint(mod.G, rule=bigm_only(gen_rule_max_dual1))
 def gen_rule_max_dual2(mod,i):
-	return mod.genmax_dual[i] <= (mod.M * (1 - mod.z_genmax[i])) 
-mod.GenMaxConstraintDual2 = Constraint(mod.N, rule=gen_rule_max_dual2)
+	return mod.genmax_dual[i] <= (mod.Mgenmax_dual[i] * (1 - mod.z_genmax[i])) 
+mod.GenMaxConstraintDual2 = Constraint(mod.G, rule=bigm_only(gen_rule_max_dual2))
 
 #Generation Min Dual	[Phi^(E.min)]
 def gen_rule_min_dual1(mod,i):
-	return mod.gen[i] <= mod.Mgen * mod.z_genmin[i] 
-mod.GenMinConstraintDual1 = Constraint(mod.N, rule=gen_rule_min_dual1)
+	return mod.gen[i] <= mod.Mgenmin[i] * mod.z_genmin[i] 
+mod.GenMinConstraintDual1 = Constraint(mod.G, rule=bigm_only(gen_rule_min_dual1))
 def gen_rule_min_dual2(mod,i):
-	return mod.genmin_dual[i] <= (mod.M * (1 - mod.z_genmin[i])) 
-mod.GenMinConstraintDual2 = Constraint(mod.N, rule=gen_rule_min_dual2)
+	return mod.genmin_dual[i] <= (mod.Mgenmin_dual[i] * (1 - mod.z_genmin[i])) 
+mod.GenMinConstraintDual2 = Constraint(mod.G, rule=bigm_only(gen_rule_min_dual2))
 
 ###########
 
 #Unmet Demand Max Dual 	[Phi^(D.max)]
 def unmet_rule_max_dual1(mod,i):
-	return mod.dem[i] - mod.unmet[i] <= mod.Mdem * mod.z_unmetmax[i] 
-mod.UnmetMaxConstraint1 = Constraint(mod.N, rule=unmet_rule_max_dual1)
+	return mod.dem[i] - mod.unmet[i] <= mod.Munmetmax[i] * mod.z_unmetmax[i] 
+mod.UnmetMaxConstraint1 = Constraint(mod.D, rule=bigm_only(unmet_rule_max_dual1))
 def unmet_rule_max_dual2(mod,i):
-	return mod.unmetmax_dual[i] <= mod.M * (1 - mod.z_unmetmax[i]) 
-mod.UnmetMaxConstraint2 = Constraint(mod.N, rule=unmet_rule_max_dual2)
+	return mod.unmetmax_dual[i] <= mod.Munmetmax_dual[i] * (1 - mod.z_unmetmax[i]) 
+mod.UnmetMaxConstraint2 = Constraint(mod.D, rule=bigm_only(unmet_rule_max_dual2))
 
 #Unmet Demand Min Dual 	[Phi^(D.min)]
 def unmet_rule_min_dual1(mod,i):
-	return mod.unmet[i] <= mod.Mdem * mod.z_unmetmin[i] 
-mod.UnmetMinConstraint1 = Constraint(mod.N, rule=unmet_rule_min_dual1)
+	return mod.unmet[i] <= mod.Munmetmin[i] * mod.z_unmetmin[i] 
+mod.UnmetMinConstraint1 = Constraint(mod.D, rule=bigm_only(unmet_rule_min_dual1))
 def unmet_rule_min_dual2(mod,i):
-	return mod.unmetmin_dual[i] <= mod.M * (1 - mod.z_unmetmin[i]) 
-mod.UnmetMinConstraint2 = Constraint(mod.N, rule=unmet_rule_min_dual2)
+	return mod.unmetmin_dual[i] <= mod.Munmetmin_dual[i] * (1 - mod.z_unmetmin[i]) 
+mod.UnmetMinConstraint2 = Constraint(mod.D, rule=bigm_only(unmet_rule_min_dual2))
 
 ###########
 
 #Transmission Capacicty Max Dual	[Phi^(L.Max)]
 def cap_rule_max_dual1(mod, i, j):
 	return ( (mod.cap[i,j] * mod.x_star[i,j]) - mod.tran[i,j]
-		<= (mod.Mcap * mod.z_capmax[i,j]) )
-mod.CapMaxConstraintDual1 = Constraint(mod.L, rule=cap_rule_max_dual1)
+		<= (mod.Mcapmax[i,j] * mod.z_capmax[i,j]) )
+mod.CapMaxConstraintDual1 = Constraint(mod.L, rule=bigm_only(cap_rule_max_dual1))
 def cap_rule_max_dual2(mod, i, j):
-	return mod.capmax_dual[i,j] <= (mod.M * (1 - mod.z_capmax[i,j])) 
-mod.CapMaxConstraintDual2 = Constraint(mod.L, rule=cap_rule_max_dual2)
+	return mod.capmax_dual[i,j] <= (mod.Mcapmax_dual[i,j] * (1 - mod.z_capmax[i,j])) 
+mod.CapMaxConstraintDual2 = Constraint(mod.L, rule=bigm_only(cap_rule_max_dual2))
 
 #Transmission Capacicty Min Dual	[Phi^(L.Min)]
 def cap_rule_min_dual1(mod, i, j):
 	return ( (mod.cap[i,j] * mod.x_star[i,j]) + mod.tran[i,j]
-		<= mod.Mcap * mod.z_capmin[i,j] )
-mod.CapMinConstraintDual1 = Constraint(mod.L, rule=cap_rule_min_dual1)
+		<= mod.Mcapmin[i,j] * mod.z_capmin[i,j] )
+mod.CapMinConstraintDual1 = Constraint(mod.L, rule=bigm_only(cap_rule_min_dual1))
 def cap_rule_min_dual2(mod, i, j):
-	return mod.capmin_dual[i,j] <= (mod.M * (1 - mod.z_capmin[i,j])) 
-mod.CapMinConstraintDual2 = Constraint(mod.L, rule=cap_rule_min_dual2)
+	return mod.capmin_dual[i,j] <= (mod.Mcapmin_dual[i,j] * (1 - mod.z_capmin[i,j])) 
+mod.CapMinConstraintDual2 = Constraint(mod.L, rule=bigm_only(cap_rule_min_dual2))
 
 ###########
 
 # Theta Rules Max Dual		[Phi^(N.max)]
 def theta_rule_max_dual1(mod,i):
-	return  math.pi - mod.theta[i] <= mod.Mtheta * mod.z_thetamax[i] 
-mod.ThetaMaxConstraint1 = Constraint(mod.N, rule=theta_rule_max_dual1)
+	return  math.pi - mod.theta[i] <= mod.Mthetamax[i] * mod.z_thetamax[i] 
+mod.ThetaMaxConstraint1 = Constraint(mod.N, rule=bigm_only(theta_rule_max_dual1))
 def theta_rule_max_dual2(mod,i):
-	return mod.thetamax_dual[i] <= mod.M * (1 - mod.z_thetamax[i]) 
-mod.ThetaMaxConstraint2 = Constraint(mod.N, rule=theta_rule_max_dual2)
+	return mod.thetamax_dual[i] <= mod.Mthetamax_dual[i] * (1 - mod.z_thetamax[i]) 
+mod.ThetaMaxConstraint2 = Constraint(mod.N, rule=bigm_only(theta_rule_max_dual2))
 
 # Theta Rules Min Dual		[Phi^(N.min)]
 def theta_rule_min_dual1(mod,i):
-	return mod.theta[i] + math.pi <= mod.Mtheta * mod.z_thetamin[i] 
-mod.ThetaMinConstraint1 = Constraint(mod.N, rule=theta_rule_min_dual1)
+	return mod.theta[i] + math.pi <= mod.Mthetamin[i] * mod.z_thetamin[i] 
+mod.ThetaMinConstraint1 = Constraint(mod.N, rule=bigm_only(theta_rule_min_dual1))
 def theta_rule_min_dual2(mod,i):
-	return mod.thetamin_dual[i] <= mod.M * (1 - mod.z_thetamin[i]) 
-mod.ThetaMinConstraint2 = Constraint(mod.N, rule=theta_rule_min_dual2)
+	return mod.thetamin_dual[i] <= mod.Mthetamin_dual[i] * (1 - mod.z_thetamin[i]) 
+mod.ThetaMinConstraint2 = Constraint(mod.N, rule=bigm_only(theta_rule_min_dual2))
+
+#############################################
+#SOS1 Complementarity Constraints
+#############################################
+
+#Index sets of the slacks, empty unless RC.COMP is "sos1"
+def sos1_index(name):
+	def index_rule(mod):
+		return list(getattr(mod, name)) if RC.COMP == "sos1" else []
+	return index_rule
+mod.Gsos = 	Set(within=mod.G, initialize=sos1_index('G'))
+mod.Dsos = 	Set(within=mod.D, initialize=sos1_index('D'))
+mod.Lsos = 	Set(within=mod.L, initialize=sos1_index('L'))
+mod.Nsos = 	Set(within=mod.N, initialize=sos1_index('N'))
+
+#Slacks of the primal inequalities (gen and unmet are their own slacks)
+mod.s_genmax 	= Var(mod.Gsos, domain=NonNegativeReals)	#genpos - gen
+mod.s_unmetmax 	= Var(mod.Dsos, domain=NonNegativeReals)	#dem - unmet
+mod.s_capmax 	= Var(mod.Lsos, domain=NonNegativeReals)	#cap*x - tran
+mod.s_capmin 	= Var(mod.Lsos, domain=NonNegativeReals)	#cap*x + tran
+mod.s_thetamax 	= Var(mod.Nsos, domain=NonNegativeReals)	#pi - theta
+mod.s_thetamin 	= Var(mod.Nsos, domain=NonNegativeReals)	#theta + pi
+
+def gen_slack_max(mod,i):
+	return mod.s_genmax[i] == mod.genpos[i] - mod.gen[i]
+mod.GenMaxSlack = Constraint(mod.G, rule=sos1_only(gen_slack_max))
+def unmet_slack_max(mod,i):
+	return mod.s_unmetmax[i] == mod.dem[i] - mod.unmet[i]
+mod.UnmetMaxSlack = Constraint(mod.D, rule=sos1_only(unmet_slack_max))
+def cap_slack_max(mod,i,j):
+	return mod.s_capmax[i,j] == mod.cap[i,j] * mod.x_star[i,j] - mod.tran[i,j]
+mod.CapMaxSlack = Constraint(mod.L, rule=sos1_only(cap_slack_max))
+def cap_slack_min(mod,i,j):
+	return mod.s_capmin[i,j] == mod.cap[i,j] * mod.x_star[i,j] + mod.tran[i,j]
+mod.CapMinSlack = Constraint(mod.L, rule=sos1_only(cap_slack_min))
+def theta_slack_max(mod,i):
+	return mod.s_thetamax[i] == math.pi - mod.theta[i]
+mod.ThetaMaxSlack = Constraint(mod.N, rule=sos1_only(theta_slack_max))
+def theta_slack_min(mod,i):
+	return mod.s_thetamin[i] == mod.theta[i] + math.pi
+mod.ThetaMinSlack = Constraint(mod.N, rule=sos1_only(theta_slack_min))
+
+#At most one of the slack and the dual of each pair is nonzero
+def gen_sos_max(mod,i):
+	return [mod.s_genmax[i], mod.genmax_dual[i]]
+mod.GenMaxSOS = SOSConstraint(mod.G, rule=sos1_set(gen_sos_max), sos=1)
+def gen_sos_min(mod,i):
+	return [mod.gen[i], mod.genmin_dual[i]]
+mod.GenMinSOS = SOSConstraint(mod.G, rule=sos1_set(gen_sos_min), sos=1)
+def unmet_sos_max(mod,i):
+	return [mod.s_unmetmax[i], mod.unmetmax_dual[i]]
+mod.UnmetMaxSOS = SOSConstraint(mod.D, rule=sos1_set(unmet_sos_max), sos=1)
+def unmet_sos_min(mod,i):
+	return [mod.unmet[i], mod.unmetmin_dual[i]]
+mod.UnmetMinSOS = SOSConstraint(mod.D, rule=sos1_set(unmet_sos_min), sos=1)
+def cap_sos_max(mod,i,j):
+	return [mod.s_capmax[i,j], mod.capmax_dual[i,j]]
+mod.CapMaxSOS = SOSConstraint(mod.L, rule=sos1_set(cap_sos_max), sos=1)
+def cap_sos_min(mod,i,j):
+	return [mod.s_capmin[i,j], mod.capmin_dual[i,j]]
+mod.CapMinSOS = SOSConstraint(mod.L, rule=sos1_set(cap_sos_min), sos=1)
+def theta_sos_max(mod,i):
+	return [mod.s_thetamax[i], mod.thetamax_dual[i]]
+mod.ThetaMaxSOS = SOSConstraint(mod.N, rule=sos1_set(theta_sos_max), sos=1)
+def theta_sos_min(mod,i):
+	return [mod.s_thetamin[i], mod.thetamin_dual[i]]
+mod.ThetaMinSOS = SOSConstraint(mod.N, rule=sos1_set(theta_sos_min), sos=1)
+
+#############################################
+#Complementarity Pairs
+#############################################
+
+#(Index set, slack of the primal row, dual, binary) of each pair
+#	z = 0  -->  slack = 0,		z = 1  -->  dual = 0
+PAIRS = (
+	('G', lambda m, i: m.genpos[i] - m.gen[i], 'genmax_dual', 'z_genmax'),
+	('G', lambda m, i: m.gen[i], 'genmin_dual', 'z_genmin'),
+	('D', lambda m, i: m.dem[i] - m.unmet[i], 'unmetmax_dual', 'z_unmetmax'),
+	('D', lambda m, i: m.unmet[i], 'unmetmin_dual', 'z_unmetmin'),
+	('L', lambda m, l: m.cap[l] * m.x_star[l] - m.tran[l],
+		'capmax_dual', 'z_capmax'),
+	('L', lambda m, l: m.cap[l] * m.x_star[l] + m.tran[l],
+		'capmin_dual', 'z_capmin'),
+	('N', lambda m, i: math.pi - m.theta[i], 'thetamax_dual', 'z_thetamax'),
+	('N', lambda m, i: m.theta[i] + math.pi, 'thetamin_dual', 'z_thetamin'))
 
 ##################################
 #Differentiating the Lagrangian
@@ -306,7 +451,7 @@ mod.ThetaMinConstraint2 = Constraint(mod.N, rule=theta_rule_min_dual2)
 def lag_gen(mod,i):
 	return ((mod.sigma * mod.gencost[i]) - mod.flow_dual[i] 
 			+ mod.genmax_dual[i] -  mod.genmin_dual[i] == 0)
-mod.LagrangianGenConstraint = Constraint(mod.N, rule=lag_gen)
+mod.LagrangianGenConstraint = Constraint(mod.G, rule=lag_gen)
 
 
 #Lagrangian with respect to Unmet Demand
@@ -314,7 +459,7 @@ mod.LagrangianGenConstraint = Constraint(mod.N, rule=lag_gen)
 def lag_unmet(mod,i):
 	return ((mod.sigma * mod.shed[i]) - mod.flow_dual[i]
 			+ mod.unmetmax_dual[i] -  mod.unmetmin_dual[i] == 0) 
-mod.LagrangianUnmetConstraint = Constraint(mod.N, rule=lag_unmet)
+mod.LagrangianUnmetConstraint = Constraint(mod.D, rule=lag_unmet)
 
 
 #Lagrangian with respect to Tranmission
@@ -334,17 +479,386 @@ mod.LagrangianTransConstraint = Constraint(mod.L, rule=lag_trans)
 #		+ ThetaMax_Dual + ThetaMin_Dual = 0
 #Only consider Lines that are in network
 def lag_theta(mod,i):	
+	net = RN.net_of(mod)
 	if_ref = 1 if i == mod.ref else 0
-	return (  sum(mod.x_star[j,j2] * mod.b[j,j2] * mod.theta_dual[j,j2]
-					for (j,j2) in mod.L if (j == i))
-		    - sum(mod.x_star[j,j2] * mod.b[j,j2] * mod.theta_dual[j,j2]
-					for (j,j2) in mod.L if (j2 == i))
+	return (  sum(mod.x_star[l] * mod.b[l] * mod.theta_dual[l]
+					for l in net['out'][i])
+		    - sum(mod.x_star[l] * mod.b[l] * mod.theta_dual[l]
+					for l in net['in'][i])
 			+ mod.thetamax_dual[i] - mod.thetamin_dual[i]
 			- (mod.ref_dual * if_ref) == 0 )
 mod.LagrangianThetaConstraint = Constraint(mod.N, rule=lag_theta)	
 
 
- 
+
+
+###############################################################
+#Subproblem Function
+
+# sub_func(isub, x, linevars, linecons)
+
+#Input- Isub. The concrete version of the subproblem.
+#		X. Lines built on each route. Usually imast.x from the master.
+#		Linevars, Linecons. Names of the per-line components of the
+#			model in "isub". Default to the ones of this model.
+
+#Output- Makes changes in the "isub" instance
+#
+# Sets x_star in the subproblem to the design being evaluated.
+# x_star is the only data that changes between iterations, and it is
+# a mutable parameter, so one instance can be solved again for each
+# new design without rebuilding its constraints.
+#
+# With RC.DROPLINES, lines that are not built are also taken out of
+# the problem the solver sees. Their variables are fixed at zero and
+# their rows deactivated, since with x_star = 0 those rows are either
+# trivially satisfied or all zero.
+###############################################################
+
+#Components of a line that only matter if the line is built
+LINEVARS = ('tran', 'theta_dual', 'capmax_dual', 'capmin_dual',
+			'z_capmax', 'z_capmin', 's_capmax', 's_capmin')
+LINECONS = ('CapConstraint', 'ThetaConstraint', 'CapMaxConstraintDual1',
+			'CapMaxConstraintDual2', 'CapMinConstraintDual1',
+			'CapMinConstraintDual2', 'LagrangianTransConstraint',
+			'CapMaxSlack', 'CapMinSlack', 'CapMaxSOS', 'CapMinSOS')
+
+def sub_func(isub, x, linevars=LINEVARS, linecons=LINECONS):
+	for xi in x:
+		isub.x_star[xi] = int(round(value(x[xi])))
+
+	if not RC.DROPLINES:
+		return
+
+	for l in isub.L:
+		built = value(isub.x_star[l]) > 0
+		for v in linevars:
+			var = getattr(isub, v)
+			if l not in var:
+				continue
+			if built:
+				var[l].unfix()
+			else:
+				var[l].fix(0)
+		for c in linecons:
+			con = getattr(isub, c)
+			if l not in con:
+				continue
+			if built:
+				con[l].activate()
+			else:
+				con[l].deactivate()
+
+
+###############################################################
+#Subproblem Start
+
+# sub_start(isub, dem, genpos)
+
+#Input- Isub. The concrete version of the subproblem, with x_star set.
+#		Dem, Genpos. The last worst case. Usually the first of the
+#			scenarios of the last sub_topk, which has the highest
+#			objective.
+
+#Output- Values of the variables of "isub" for a MIP start.
+#		 False if no start could be made.
+#
+# The last worst case is usually close to the next one, but its
+# dispatch and binaries are for the old design. The dispatch is
+# found again for the new x_star (see ruizDisp), and each binary is
+# set from the slack of its primal row, z = 1 where the slack is
+# positive. The duals, and anything the dispatch leaves without a
+# value, are left empty for the solver to complete when it reads
+# the start.
+###############################################################
+
+def sub_start(isub, dem, genpos):
+
+	disp = RDI.disp_solve(isub, dem, genpos, isub.x_star)
+	if disp is None:
+		return False
+	vals = RDI.disp_values(disp)
+
+	for v in isub.component_data_objects(Var):
+		if not v.fixed:
+			v.value = None
+
+	for i in isub.D:
+		isub.dem[i].set_value(value(dem[i]), skip_validation=True)
+	for i in isub.G:
+		isub.genpos[i].set_value(value(genpos[i]), skip_validation=True)
+	for name in RDI.DISPVARS:
+		var = getattr(isub, name)
+		for i, val in vals[name].items():
+			if not var[i].fixed:
+				var[i].set_value(val, skip_validation=True)
+
+	for setname, slack, dual, z in PAIRS:
+		for i in getattr(isub, setname):
+			zvar = getattr(isub, z)[i]
+			gap = value(slack(isub, i), exception=False)
+			if not zvar.fixed and gap is not None:
+				zvar.set_value(int(gap > RC.EPSILON))
+	return True
+
+
+###############################################################
+#Subproblem Top K
+
+# sub_topk(isub, k, solve, nogood, gap, limit)
+
+#Input- Isub. The concrete version of the subproblem, solved.
+#		K. Number of worst cases wanted.
+#		Solve, Nogood. Solve and no-good cut functions of the
+#			engine. Default to the ones of this model.
+#		Gap. Relative MIP gap of the re-solves. Defaults to RC.MIPGAP.
+#		Limit. Function giving the time limit of the next re-solve,
+#			as ruizMain's limit, or None for no limit.
+
+#Output- List of up to k distinct worst cases (obj, dem, genpos),
+#		 worst first, with dem and genpos as {node: value}.
+#		 The solution in "isub" is left as the worst case.
+#
+# Each re-solve adds a no-good cut on the last solution, so the
+# solver has to move to another one. Solutions whose scenario rounds
+# to one already found (see ruizMast.mast_key) are passed over.
+# At most 2(k-1) re-solves are made, and none once the no-good cut
+# function finds no cut to make (it gives None) or the time is up.
+# A re-solve stopped by its time limit still gives the worst case it
+# found, if any, and ends the search.
+###############################################################
+
+def sub_topk(isub, k, solve=None, nogood=None, gap=None, limit=None):
+
+	if solve is None:
+		solve = sub_solve
+	if nogood is None:
+		nogood = sub_nogood
+	scens = [sub_scenario(isub)]
+	if k <= 1:
+		return scens
+
+	best = [(v, v.value) for v in isub.component_data_objects(Var)
+			if not v.fixed]
+	keys = set([m.mast_key(isub, scens[0][1], scens[0][2])])
+	isub.NoGood = ConstraintList()
+	for n in range(2 * (k - 1)):
+		cut = nogood(isub)
+		if cut is None:
+			break
+		isub.NoGood.add(cut)
+		timelimit = limit() if limit is not None else None
+		if timelimit is not None and timelimit <= 0:
+			break
+		results = solve(isub, load_solutions=False, gap=gap,
+						timelimit=timelimit)
+		cond = results.solver.termination_condition
+		if (results.solver.status == SolverStatus.error
+			or cond not in (TerminationCondition.optimal,
+							TerminationCondition.maxTimeLimit)):
+			break
+		if len(results.solution):
+			isub.solutions.load_from(results)
+		scen = sub_scenario(isub)
+		key = m.mast_key(isub, scen[1], scen[2])
+		if key not in keys:
+			keys.add(key)
+			scens.append(scen)
+		if len(scens) == k or cond != TerminationCondition.optimal:
+			break
+
+	isub.del_component(isub.NoGood)
+	for v, val in best:
+		v.set_value(val, skip_validation=True)
+	return sorted(scens, key=lambda scen: -scen[0])
+
+#No-good cut of the scenario in isub
+#	The binaries here are for complementarity and many of them give
+#	the same scenario, so the cut is on the scenario itself. Every
+#	node at an end of its range has to move from it, in sum, by
+#	RC.TOPDIST of the total range. None if no node is at an end, as
+#	then no cut on the scenario is linear.
+def sub_nogood(isub):
+	dist, total, ends = 0, 0, 0
+	for var, lo, hi in ([(isub.dem[i], isub.demmin[i], isub.demmax[i])
+						 for i in isub.D]
+						+ [(isub.genpos[i], isub.supmin[i], isub.supmax[i])
+						 for i in isub.G]):
+		lo, hi = value(lo), value(hi)
+		total += hi - lo
+		tol = RC.SCENTOL * (1 + hi - lo)
+		if value(var) >= hi - tol:
+			dist += hi - var
+			ends += 1
+		elif value(var) <= lo + tol:
+			dist += var - lo
+			ends += 1
+	if not ends:
+		return None
+	return dist >= RC.TOPDIST * total
+
+#Objective, demand and possible generation of the solution in isub
+def sub_scenario(isub):
+	return (value(isub.Obj),
+			dict((i, value(isub.dem[i])) for i in isub.D),
+			dict((i, value(isub.genpos[i])) for i in isub.G))
+
+
+###############################################################
+#Subproblem Solve
+
+# sub_solve(isub, warmstart, load_solutions, gap)
+
+#Input- Isub. The concrete version of the subproblem.
+#		Warmstart. Pass the values in "isub" as a MIP start.
+#			See sub_start.
+#		Load_solutions. Load the solution into "isub". If False, the
+#			caller loads it from the results. The "indicator"
+#			formulation always loads a feasible solution itself,
+#			and its results hold none.
+#		Gap. Relative MIP gap of the solve. Defaults to RC.MIPGAP.
+#		Timelimit. Seconds the solve may take, or None for no limit.
+
+#Output- Results of the solve. The solution is loaded into "isub".
+#		 A solve stopped by its time limit before it found a solution
+#		 has none, its status is "error", and "isub" is left as it
+#		 was.
+#
+# For the "bigm" and "sos1" formulations the instance is written as
+# is. For "indicator" the instance is loaded into a persistent CPLEX
+# (RC.PSOLVER), and each complementarity pair is added through the
+# CPLEX API as two indicator constraints on its z binary:
+#	z = 0  -->  slack <= 0,		z = 1  -->  dual <= 0
+# so the solver branches on the logic with no big M relaxation.
+# x_star changes between designs, so the instance is loaded again
+# for each solve. Pyomo does not read back models with indicator
+# constraints, so CPLEX is called directly and the solution is
+# loaded into "isub" here.
+###############################################################
+
+def sub_solve(isub, warmstart=False, load_solutions=True, gap=None,
+			  timelimit=None):
+
+	if gap is None:
+		gap = RC.MIPGAP
+	if RC.COMP != "indicator" and timelimit is None:
+		return opt.solve(isub, warmstart=warmstart,
+						 load_solutions=load_solutions,
+						 options={'mipgap': gap})
+	if RC.COMP != "indicator":
+		results = opt.solve(isub, warmstart=warmstart, load_solutions=False,
+							options={'mipgap': gap, 'timelimit': timelimit})
+		if load_solutions and results.solver.status != SolverStatus.error:
+			isub.solutions.load_from(results)
+		return results
+
+	if RC.PSOLVER != "cplex_persistent":
+		raise ValueError("Indicator formulation needs cplex_persistent,"
+			" not " + RC.PSOLVER)
+	from cplex import SparsePair
+
+	iopt = SolverFactory(RC.PSOLVER)
+	iopt.set_instance(isub)
+	cpx = iopt._solver_model
+	vmap = iopt._pyomo_var_to_solver_var_map
+	cpx.parameters.mip.tolerances.mipgap.set(gap)
+	if timelimit is not None:
+		cpx.parameters.timelimit.set(timelimit)
+	for stream in (cpx.set_log_stream, cpx.set_results_stream,
+				   cpx.set_warning_stream):
+		stream(None)
+
+	for setname, slack, dual, z in PAIRS:
+		for i in getattr(isub, setname):
+			zvar = getattr(isub, z)[i]
+			if zvar.fixed:
+				continue
+			repn = generate_standard_repn(slack(isub, i))
+			cpx.indicator_constraints.add(
+				lin_expr=SparsePair([vmap[v] for v in repn.linear_vars],
+									list(repn.linear_coefs)),
+				sense='L', rhs=-repn.constant,
+				indvar=vmap[zvar], complemented=1)
+			cpx.indicator_constraints.add(
+				lin_expr=SparsePair([vmap[getattr(isub, dual)[i]]], [1]),
+				sense='L', rhs=0, indvar=vmap[zvar], complemented=0)
+
+	if warmstart:
+		start = [v for v in vmap if v.value is not None and not v.fixed]
+		cpx.MIP_starts.add([[vmap[v] for v in start],
+							[value(v) for v in start]],
+						   cpx.MIP_starts.effort_level.auto)
+
+	cpx.solve()
+	return sub_load(isub, cpx, vmap)
+
+
+###############################################################
+#Subproblem Bound
+
+# sub_bound(isub, results)
+
+#Input-	Isub. The concrete version of the subproblem, solved.
+#		Results. Results of sub_solve.
+
+#Output- Upper bound on the worst-case cost of the design in "isub".
+#		 The solver's best bound, or the objective if it gave none.
+#
+# With a MIP gap the worst case found is only within the gap of the
+# true one, so its objective is not an upper bound of the problem.
+###############################################################
+
+def sub_bound(isub, results):
+
+	bound = results.problem.upper_bound
+	if bound is None or not math.isfinite(bound):
+		return value(isub.Obj)
+	return max(bound, value(isub.Obj))
+
+
+###############################################################
+#Subproblem Load
+
+# sub_load(isub, cpx, vmap)
+
+#Input-	Isub. The concrete version of the subproblem.
+#		Cpx. CPLEX object "isub" was solved in.
+#		Vmap. Pyomo variable --> CPLEX variable.
+
+#Output- SolverResults of the solve, and the solution in "isub".
+###############################################################
+
+def sub_load(isub, cpx, vmap):
+
+	results = SolverResults()
+	results.solver.name = RC.PSOLVER
+	results.solver.message = cpx.solution.get_status_string()
+	sol = cpx.solution
+	if sol.get_status() in (sol.status.MIP_optimal,
+							sol.status.optimal_tolerance):
+		results.solver.status = SolverStatus.ok
+		results.solver.termination_condition = TerminationCondition.optimal
+	elif sol.get_status() == sol.status.MIP_time_limit_feasible:
+		results.solver.status = SolverStatus.aborted
+		results.solver.termination_condition = TerminationCondition.maxTimeLimit
+	elif sol.get_status() == sol.status.MIP_time_limit_infeasible:
+		results.solver.status = SolverStatus.error
+		results.solver.termination_condition = TerminationCondition.maxTimeLimit
+	else:
+		results.solver.status = SolverStatus.warning
+		results.solver.termination_condition = TerminationCondition.other
+	if not sol.is_primal_feasible():
+		return results
+
+	results.problem.upper_bound = sol.MIP.get_best_objective()
+	results.problem.lower_bound = sol.get_objective_value()
+	pyvars = list(vmap.keys())
+	vals = sol.get_values([vmap[v] for v in pyvars])
+	for v, val in zip(pyvars, vals):
+		if not v.fixed:
+			v.set_value(val, skip_validation=True)
+	return results
+
 
 ##########
 #TO TEST